@@ -0,0 +1,169 @@
+"""REST API over the portal's data, for registrar systems and other bulk clients.
+
+Uses the same data functions as the Streamlit app, so both see the same
+rules. Every request authenticates with an admin account over HTTP Basic
+auth and works on the campus named by the X-Shard header (the first shard
+by default). Listings are paged by id, GET responses carry an ETag so an
+unchanged result costs a 304, and large responses are gzipped when the
+client accepts it.
+
+    python api.py --port 8000
+    curl -u admin:secret 'http://localhost:8000/api/students?course=MCA&limit=500'
+    curl -u admin:secret -X PUT -H 'Content-Type: application/json' \
+         -d '[{"register_no": "RA2311", "name": "...", "course": "MCA"}]' \
+         http://localhost:8000/api/students
+"""
+import argparse
+import functools
+import gzip
+
+from flask import Flask, abort, jsonify, request
+from werkzeug.exceptions import HTTPException
+
+from db import IntegrityError, unit_of_work
+from shards import get_shard, init_shards, use_shard
+from data import (check_user, is_admin, get_all_courses, list_students, get_student, upsert_students,
+                  UPSERT_FIELDS, register_students, get_pending_registrations, approve_registration, add_course)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Responses smaller than this aren't worth compressing
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+
+app = Flask(__name__)
+
+def api_route(rule, **options):
+    # Admin-only endpoint whose data calls share one unit of work
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # X-Shard picks the campus; the first one by default
+            try:
+                shard = get_shard(request.headers.get('X-Shard'))
+            except KeyError:
+                abort(400, description='unknown shard')
+            with use_shard(shard), unit_of_work():
+                auth = request.authorization
+                user = auth and check_user(auth.username or '', auth.password or '')
+                if not user or not is_admin(user['id']):
+                    return jsonify(error='admin credentials required'), 401, {'WWW-Authenticate': 'Basic realm="api"'}
+                return func(*args, **kwargs)
+        return app.route(rule, **options)(wrapper)
+    return decorator
+
+def json_body(kind=list):
+    body = request.get_json(silent=True)
+    if not isinstance(body, kind):
+        abort(400, description='expected a JSON ' + ('array' if kind is list else 'object'))
+    return body
+
+@app.errorhandler(HTTPException)
+def http_error(error):
+    return jsonify(error=error.description), error.code
+
+@app.after_request
+def conditional_and_compressed(response):
+    if request.method != 'GET' or response.status_code != 200 or response.direct_passthrough:
+        return response
+    # Weak, because the same entity may be sent gzipped or not
+    response.add_etag(weak=True)
+    response.make_conditional(request)
+    if response.status_code == 304:
+        return response
+    response.vary.add('Accept-Encoding')
+    if 'gzip' in request.accept_encodings and response.content_length and response.content_length >= GZIP_MIN_BYTES:
+        response.set_data(gzip.compress(response.get_data(), GZIP_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+# Students
+
+@api_route('/api/students', methods=['GET'])
+def students_page():
+    limit = max(min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE), 1)
+    rows = list_students(request.args.get('q', ''), request.args.get('course') or None,
+                         after_id=request.args.get('after', 0, type=int), limit=limit)
+    students = [dict(row) for row in rows]
+    # The id to pass as ?after= for the next page; null on the last one
+    following = students[-1]['id'] if len(students) == limit else None
+    return jsonify(students=students, next=following)
+
+@api_route('/api/students/<int:student_id>', methods=['GET'])
+def student(student_id):
+    row = get_student(student_id)
+    if row is None:
+        abort(404)
+    return jsonify(dict(row))
+
+@api_route('/api/students', methods=['PUT'])
+def upsert():
+    # Students are matched on register_no: new ones are added, existing ones
+    # replaced (fields left out are cleared, as PUT implies)
+    records = json_body()
+    courses = set(get_all_courses())
+    valid, errors = [], []
+    for position, record in enumerate(records):
+        if not isinstance(record, dict) or not record.get('register_no'):
+            errors.append((position, 'register_no is required'))
+        elif record.get('course') and record['course'] not in courses:
+            errors.append((position, f"unknown course {record['course']!r}"))
+        else:
+            valid.append((position, {field: record.get(field) for field in UPSERT_FIELDS}))
+    saved, failed = upsert_students([record for _, record in valid])
+    errors += [(valid[index][0], message) for index, message in failed]
+    return jsonify(saved=saved, errors=[{'index': position, 'error': message} for position, message in sorted(errors)])
+
+# Registrations
+
+@api_route('/api/registrations', methods=['GET'])
+def registrations():
+    return jsonify([dict(row) for row in get_pending_registrations()])
+
+@api_route('/api/registrations', methods=['POST'])
+def register():
+    records = json_body()
+    fields = ('username', 'password', 'name', 'email', 'course')
+    if not all(isinstance(record, dict) and all(record.get(field) for field in fields) for record in records):
+        abort(400, description=f"each registration needs {', '.join(fields)}")
+    results = register_students([tuple(record[field] for field in fields) for record in records])
+    return jsonify([{'ok': ok, 'message': message} for ok, message in results])
+
+@api_route('/api/registrations/approve', methods=['POST'])
+def approve():
+    ids = json_body(dict).get('ids')
+    if not isinstance(ids, list) or not all(isinstance(registration_id, int) for registration_id in ids):
+        abort(400, description='expected {"ids": [...]}')
+    approved, missing, failed = [], [], []
+    for registration_id in ids:
+        try:
+            (approved if approve_registration(registration_id) else missing).append(registration_id)
+        except IntegrityError:
+            # Username taken by an existing account
+            failed.append(registration_id)
+    return jsonify(approved=approved, missing=missing, failed=failed)
+
+# Courses
+
+@api_route('/api/courses', methods=['GET'])
+def courses():
+    return jsonify(get_all_courses())
+
+@api_route('/api/courses', methods=['POST'])
+def create_courses():
+    names = json_body()
+    if not all(isinstance(name, str) and name for name in names):
+        abort(400, description='expected a list of course names')
+    added = [name for name in names if add_course(name)]
+    return jsonify(added=added, existing=[name for name in names if name not in added])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    init_shards()
+    app.run(host=args.host, port=args.port, threaded=True)
+
+if __name__ == '__main__':
+    main()
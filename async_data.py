@@ -0,0 +1,106 @@
+"""asyncio versions of the data functions, for API servers and batch jobs.
+
+sqlite3 and file reads block, so coroutines hand them to dedicated thread
+pools and await the result: one pool for the database, whose threads each
+run a call in their own unit of work, and one for file I/O, which moves
+files in chunks so a large resume never sits in memory whole. The event
+loop stays free to serve other requests meanwhile, and concurrency is
+bounded by the pool sizes rather than by a thread per request.
+
+Calls go to the shard given as shard=, or else the shard the awaiting
+thread has selected with use_shard; pool threads don't inherit it.
+"""
+import asyncio
+import functools
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.utils import secure_filename
+
+import data
+from db import unit_of_work
+from file_index import upload_changed
+from queries import STUDENT_DETAIL_FIELDS, PENDING_LISTING_FIELDS
+from shards import current_shard, upload_path, use_shard
+
+# SQLite allows one writer at a time, so more database threads mostly add
+# readers; file threads wait on the disk and can be more
+DB_THREADS = 8
+FILE_THREADS = 16
+CHUNK_SIZE = 256 * 1024
+
+_db_executor = ThreadPoolExecutor(DB_THREADS, thread_name_prefix='db')
+_file_executor = ThreadPoolExecutor(FILE_THREADS, thread_name_prefix='files')
+
+def _in_unit_of_work(shard, func, *args, **kwargs):
+    with use_shard(shard), unit_of_work():
+        return func(*args, **kwargs)
+
+async def run_db(func, *args, shard=None, **kwargs):
+    # Run func on a database thread, on the shard; data functions it calls
+    # share one unit of work, so they see one snapshot and commit together
+    loop = asyncio.get_running_loop()
+    call = functools.partial(_in_unit_of_work, shard or current_shard(), func, *args, **kwargs)
+    return await loop.run_in_executor(_db_executor, call)
+
+async def _run_file(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_file_executor, func, *args)
+
+# Queries
+
+async def search_students(search_query='', course_filter=None, fields=STUDENT_DETAIL_FIELDS, shard=None):
+    return await run_db(data.search_students, search_query, course_filter, fields, shard=shard)
+
+async def list_students(search_query='', course_filter=None, after_id=0, limit=100, fields=STUDENT_DETAIL_FIELDS,
+                        shard=None):
+    return await run_db(data.list_students, search_query, course_filter, after_id, limit, fields, shard=shard)
+
+async def get_pending_registrations(fields=PENDING_LISTING_FIELDS, shard=None):
+    return await run_db(data.get_pending_registrations, fields, shard=shard)
+
+# Files
+
+async def stream_file(path, chunk_size=CHUNK_SIZE):
+    # Yields the file's contents chunk by chunk
+    f = await _run_file(open, path, 'rb')
+    try:
+        while True:
+            chunk = await _run_file(f.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        await _run_file(f.close)
+
+async def read_file(path):
+    return b''.join([chunk async for chunk in stream_file(path)])
+
+async def save_file(name, source, folder, shard=None):
+    # source: bytes, or an async iterable of byte chunks such as a request
+    # body. folder is relative to the shard's upload root, as in
+    # data.save_file. Written under a temporary name and renamed once
+    # complete, so readers never see a partial upload.
+    with use_shard(shard or current_shard()):
+        folder = upload_path(folder)
+    await _run_file(functools.partial(os.makedirs, folder, exist_ok=True))
+    file_path = os.path.join(folder, secure_filename(name))
+    fd, tmp_path = await _run_file(functools.partial(tempfile.mkstemp, dir=folder, suffix='.part'))
+    f = os.fdopen(fd, 'wb')
+    try:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            await _run_file(f.write, source)
+        else:
+            async for chunk in source:
+                await _run_file(f.write, chunk)
+        await _run_file(f.close)
+        await _run_file(os.replace, tmp_path, file_path)
+    except BaseException:
+        f.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    # A stat, so it runs on a file thread too
+    await _run_file(upload_changed, file_path)
+    return file_path
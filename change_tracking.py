@@ -0,0 +1,106 @@
+"""DataFrames of a table that follow its changes row by row.
+
+Admin tabs stay open for hours and refresh on a timer. A TrackedFrame holds
+one table's listing in memory for every session in the process and keeps it
+current from change_log, which triggers fill on each insert, update and
+delete. Refreshing first asks SQLite for PRAGMA data_version, which only
+moves when another connection commits; while nothing changed that single
+pragma is the whole cost, however many sessions poll. When something did
+change, only the rows logged since the last version seen are fetched and
+merged in. A view that fell behind the pruned log loads from scratch.
+"""
+import sqlite3
+import threading
+
+import pandas as pd
+
+import db
+
+# Past this many changed rows a full reload is cheaper than merging
+FULL_RELOAD_ROWS = 5000
+# SQLite's default limit on parameters per statement is 999 on old builds
+ID_CHUNK = 500
+# Log entries older than this are pruned by maintenance.py; views idle for
+# longer reload in full
+CHANGE_LOG_RETENTION = '-1 day'
+
+def latest_change(conn):
+    # The newest change_log version, even after the log has been pruned
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return row[0] if row else 0
+
+def prune_change_log(conn, retention=CHANGE_LOG_RETENTION):
+    cursor = conn.execute("DELETE FROM change_log WHERE changed_at < strftime('%Y-%m-%d %H:%M:%f', 'now', ?)",
+                          (retention,))
+    return cursor.rowcount
+
+class TrackedFrame:
+    def __init__(self, db_path, table, select, categories=(), strings=()):
+        # select(where) returns the listing's SQL for rows matching where;
+        # the listing must include the table's id column
+        self.conn = sqlite3.connect(db_path or db.DB_PATH, check_same_thread=False)
+        self.conn.isolation_level = None
+        self.table = table
+        self.select = select
+        self.categories = categories
+        self.strings = strings
+        self.frame = None
+        self.reloads = 0
+        self.merges = 0
+        self._data_version = None
+        self._seen = 0
+        self._lock = threading.Lock()
+
+    def _fetch(self, where=None, params=()):
+        return db.frame_from_cursor(self.conn.execute(self.select(where), params), self.categories, self.strings)
+
+    def _reload(self, latest):
+        self.frame = self._fetch()
+        self._seen = latest
+        self.reloads += 1
+
+    def _merge(self, ids):
+        ids = list(ids)
+        fresh = [self._fetch(f"{self.table}.id IN ({', '.join('?' * len(chunk))})", chunk)
+                 for chunk in (ids[start:start + ID_CHUNK] for start in range(0, len(ids), ID_CHUNK))]
+        kept = self.frame[~self.frame['id'].isin(ids)]
+        merged = pd.concat([kept, *fresh], ignore_index=True)
+        for column in self.categories:
+            # Categories differ between the parts; concat falls back to object
+            merged[column] = merged[column].astype('category')
+        for column in self.strings:
+            merged[column] = merged[column].astype('string[pyarrow]')
+        self.frame = merged.sort_values('id', ignore_index=True)
+        self.merges += 1
+
+    def refresh(self):
+        # Returns (frame, changed); commits to other tables leave it unchanged
+        with self._lock:
+            data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+            if data_version == self._data_version:
+                return self.frame, False
+            previous = self.frame
+            # One snapshot, so the rows read match the log read
+            self.conn.execute('BEGIN')
+            try:
+                latest = latest_change(self.conn)
+                oldest = self.conn.execute('SELECT MIN(version) FROM change_log').fetchone()[0]
+                if self.frame is None or (oldest or latest + 1) > self._seen + 1:
+                    self._reload(latest)
+                elif latest > self._seen:
+                    ids = [row[0] for row in self.conn.execute(
+                        'SELECT DISTINCT row_id FROM change_log WHERE version > ? AND version <= ? AND table_name = ?',
+                        (self._seen, latest, self.table))]
+                    if len(ids) > FULL_RELOAD_ROWS:
+                        self._reload(latest)
+                    else:
+                        if ids:
+                            self._merge(ids)
+                        self._seen = latest
+            finally:
+                self.conn.execute('COMMIT')
+            self._data_version = data_version
+            return self.frame, self.frame is not previous
+
+    def close(self):
+        self.conn.close()
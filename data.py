@@ -0,0 +1,368 @@
+"""Data access shared by the Streamlit app and the REST API.
+
+Every function joins the unit of work open on the calling thread, or opens
+its own, so callers can group several of them into one transaction.
+"""
+import logging
+import os
+from datetime import datetime, timezone
+
+import pandas as pd
+from werkzeug.utils import secure_filename
+
+from db import IntegrityError, OperationalError, contains_pattern, is_postgres, unit_of_work
+from facets import facet_clause, facet_counts, merge_facet_counts
+from file_index import upload_changed
+from passwords import hash_password
+from queries import (USERS, STUDENTS, PENDING_REGISTRATIONS, COURSES, LIVE_STUDENTS, SESSION_USER_FIELDS,
+                     STUDENT_PROFILE_FIELDS, STUDENT_DETAIL_FIELDS, STUDENT_LIST_FIELDS, PENDING_LISTING_FIELDS)
+from shards import SHARDS, shard_for_email, upload_path, use_shard
+from trigram import SIMILARITY_THRESHOLD, match_expression, similarity
+from write_queue import get_write_queue
+from year_archive import archived_facet_counts, search_archived_frame
+
+logger = logging.getLogger(__name__)
+
+def check_user(username, password, fields=SESSION_USER_FIELDS):
+    # The password hash is matched in SQL and never read back. Deleted
+    # accounts can't sign in while they wait for the purge.
+    with unit_of_work() as uow:
+        return uow.query_one(USERS.select(fields, where='users.username=? AND users.password=? AND users.deleted_at IS NULL'),
+                             (username, hash_password(password)))
+
+def get_user(user_id, fields=SESSION_USER_FIELDS):
+    # None once the account is deleted, so signed-in sessions can end
+    with unit_of_work() as uow:
+        return uow.query_one(USERS.select(fields, where='users.id=? AND users.deleted_at IS NULL'), (user_id,))
+
+def is_admin(user_id):
+    with unit_of_work() as uow:
+        result = uow.query_one(USERS.select(['is_admin'], where='users.id=?'), (user_id,))
+    return result['is_admin'] if result else False
+
+def save_file(file, folder):
+    # Relative to the current shard's upload root
+    folder = upload_path(folder)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    file_path = os.path.join(folder, secure_filename(file.name))
+    with open(file_path, 'wb') as f:
+        f.write(file.getbuffer())
+    # Don't wait for the watcher; the next reader may look for this file
+    upload_changed(file_path)
+    return file_path
+
+def get_all_courses():
+    with unit_of_work() as uow:
+        return [row['name'] for row in uow.query(COURSES.select(['name']))]
+
+def get_academic_years():
+    with unit_of_work() as uow:
+        return [row['academic_year'] for row in uow.query(f'''SELECT DISTINCT academic_year FROM students
+                                                              WHERE academic_year IS NOT NULL AND {LIVE_STUDENTS}
+                                                              ORDER BY academic_year''')]
+
+def get_course_counts():
+    with unit_of_work() as uow:
+        return uow.query(f'''SELECT courses.name, COUNT(students.id) AS students FROM courses
+                             LEFT JOIN students ON students.course_id = courses.id AND {LIVE_STUDENTS}
+                             GROUP BY courses.id''')
+
+def student_search_clause(search_query='', course_filter=None, filters=None):
+    # Matches as StudentDirectory.search does; see db.contains_pattern
+    where, params = LIVE_STUDENTS, []
+    if search_query:
+        where += (" AND (fold_case(students.name) LIKE ? ESCAPE '\\' "
+                  "OR fold_case(students.email) LIKE ? ESCAPE '\\')")
+        params += [contains_pattern(search_query)] * 2
+    
+    if course_filter:
+        # Resolve the name once through the unique index on courses.name, then
+        # filter students through the course_id index
+        where += ' AND students.course_id = (SELECT id FROM courses WHERE name = ?)'
+        params.append(course_filter)
+    # Values picked in the facet sidebar
+    facet_where, facet_params = facet_clause(filters)
+    if facet_where:
+        where += f' AND {facet_where}'
+        params.extend(facet_params)
+    return where, params
+
+def get_student_facets(search_query='', filters=None, include_archived=False):
+    # (total, {facet: [(value, count), ...]}) for the students matching the
+    # search, from one grouped query; archived years are counted only when
+    # the list includes them
+    where, params = student_search_clause(search_query)
+    result = facet_counts(where, params, filters)
+    if include_archived and not is_postgres():
+        result = merge_facet_counts([result, archived_facet_counts(search_query, filters)])
+    return result
+
+def search_students(search_query='', course_filter=None, fields=STUDENT_DETAIL_FIELDS, filters=None):
+    where, params = student_search_clause(search_query, course_filter, filters)
+    with unit_of_work() as uow:
+        return uow.query(STUDENTS.select(fields, where=where), params)
+
+def search_students_frame(search_query='', course_filter=None, fields=STUDENT_LIST_FIELDS, include_archived=False,
+                          filters=None):
+    # Only the requested columns are read, straight into a compact DataFrame.
+    # Archived years are searched only when asked for.
+    where, params = student_search_clause(search_query, course_filter, filters)
+    with unit_of_work() as uow:
+        frame = uow.query_frame(STUDENTS.select(fields, where=where), params,
+                                categories=('course', 'academic_year'),
+                                strings=('name', 'email', 'student_id', 'register_no'))
+    if include_archived and not is_postgres():
+        archived = search_archived_frame(search_query, course_filter, fields, filters=filters)
+        if not archived.empty:
+            frame = pd.concat([frame, archived], ignore_index=True)
+    return frame
+
+# Rows the trigram index hands over for scoring, best bm25 rank first
+SUGGESTION_CANDIDATES = 200
+
+def suggest_students(search_query, course_filter=None, limit=5, fields=('id', 'name', 'course')):
+    # Students whose names look like search_query, most similar first, as
+    # (similarity, row) pairs; for "did you mean" when a spelling differs.
+    # Only rows sharing trigrams with the query, found through the index,
+    # are scored. SQLite only.
+    expression = match_expression(search_query)
+    if not expression or is_postgres():
+        return []
+    fields = list(fields) if 'name' in fields else ['name', *fields]
+    where = (f'{LIVE_STUDENTS} AND students.id IN (SELECT rowid FROM student_names WHERE student_names MATCH ? '
+             'ORDER BY rank LIMIT ?)')
+    params = [expression, SUGGESTION_CANDIDATES]
+    if course_filter:
+        where += ' AND students.course_id = (SELECT id FROM courses WHERE name = ?)'
+        params.append(course_filter)
+    with unit_of_work() as uow:
+        rows = uow.query(STUDENTS.select(fields, where=where), params)
+    scored = [(similarity(search_query, row['name']), row) for row in rows]
+    scored = [pair for pair in scored if pair[0] >= SIMILARITY_THRESHOLD]
+    scored.sort(key=lambda pair: pair[0], reverse=True)
+    return scored[:limit]
+
+def list_students(search_query='', course_filter=None, after_id=0, limit=100, fields=STUDENT_DETAIL_FIELDS):
+    # One page in id order; pass the last id seen to get the next one. Seeking
+    # on the primary key costs the same for every page, unlike OFFSET.
+    where, params = student_search_clause(search_query, course_filter)
+    with unit_of_work() as uow:
+        return uow.query(STUDENTS.select(fields, where=f'{where} AND students.id > ?', order_by='students.id') + ' LIMIT ?',
+                         [*params, after_id, limit])
+
+def get_student(student_id, fields=STUDENT_DETAIL_FIELDS):
+    with unit_of_work() as uow:
+        return uow.query_one(STUDENTS.select(fields, where=f'students.id=? AND {LIVE_STUDENTS}'), (student_id,))
+
+def get_student_by_user_id(user_id, fields=STUDENT_PROFILE_FIELDS):
+    with unit_of_work() as uow:
+        return uow.query_one(STUDENTS.select(fields, where=f'students.user_id=? AND {LIVE_STUDENTS}'), (user_id,))
+
+def save_student_details(user_id, details, exists):
+    # A student deleted while signed in changes nothing: the update skips
+    # deleted rows, and no new row is added beside a deleted one or for a
+    # deleted account
+    with unit_of_work() as uow:
+        try:
+            if exists:
+                c = uow.execute(f'''UPDATE students SET name=?, email=?, course_id=(SELECT id FROM courses WHERE name=?), student_id=?, register_no=?, academic_year=?, 
+                                resume_path=?, resume_sha256=?, photo_path=? WHERE user_id=? AND {LIVE_STUDENTS}''', 
+                                (details['name'], details['email'], details['course'], 
+                                details['student_id'], details['register_no'], details['academic_year'],
+                                details['resume_path'], details['resume_sha256'], details['photo_path'], user_id))
+            else:
+                c = uow.execute('''INSERT INTO students (user_id, name, email, course_id, student_id, register_no, academic_year, 
+                                resume_path, resume_sha256, photo_path) SELECT ?, ?, ?, (SELECT id FROM courses WHERE name=?), ?, ?, ?, ?, ?, ?
+                                WHERE EXISTS (SELECT 1 FROM users WHERE id = ? AND deleted_at IS NULL)
+                                AND NOT EXISTS (SELECT 1 FROM students WHERE user_id = ?)''', 
+                                (user_id, details['name'], details['email'], details['course'], 
+                                details['student_id'], details['register_no'], details['academic_year'],
+                                details['resume_path'], details['resume_sha256'], details['photo_path'], user_id, user_id))
+            if c.rowcount == 0:
+                return False, 'Your profile was deleted. Please contact an administrator.'
+            return True, 'Details updated successfully!'
+        except IntegrityError:
+            return False, 'That register number is already used by another student.'
+
+UPSERT_FIELDS = ['name', 'email', 'course', 'student_id', 'register_no', 'academic_year']
+
+def register_numbers_unique(uow):
+    # Databases with duplicated register numbers keep a plain index on them
+    # (see schema.add_lookup_indexes), which upserts can't match on
+    if is_postgres():
+        return True
+    return any(row['name'] == 'idx_students_register_no' and row['unique']
+               for row in uow.query('PRAGMA index_list(students)'))
+
+def upsert_students(records):
+    # Insert or update students by register number, all in one transaction.
+    # A record that breaks a constraint is skipped and reported as
+    # (position, message); the others are still saved.
+    saved, errors = 0, []
+    with unit_of_work() as uow:
+        if not register_numbers_unique(uow):
+            return 0, [(position, 'register numbers are duplicated in this database; fix them before matching on them')
+                       for position in range(len(records))]
+        for position, record in enumerate(records):
+            try:
+                with uow.savepoint():
+                    # A deleted student keeps their register number until the
+                    # purge; the update skips them and nothing is written
+                    c = uow.execute('''INSERT INTO students (name, email, course_id, student_id, register_no, academic_year)
+                                    VALUES (?, ?, (SELECT id FROM courses WHERE name=?), ?, ?, ?)
+                                    ON CONFLICT (register_no) DO UPDATE SET name=excluded.name, email=excluded.email,
+                                    course_id=excluded.course_id, student_id=excluded.student_id,
+                                    academic_year=excluded.academic_year
+                                    WHERE students.deleted_at IS NULL''',
+                                    [record.get(field) for field in UPSERT_FIELDS])
+                if c.rowcount == 0:
+                    errors.append((position, 'the student was deleted; restore them or wait for the purge'))
+                    continue
+                saved += 1
+            except IntegrityError as e:
+                errors.append((position, str(e)))
+    return saved, errors
+
+def register_students(registrations):
+    # registrations: (username, password, name, email, course) tuples.
+    # Returns a (success, message) pair for each, in order.
+    results = [None] * len(registrations)
+    pending = []
+    courses = {}
+    for position, (username, password, name, email, course) in enumerate(registrations):
+        # Each campus registers into its own shard, picked by email domain
+        shard = shard_for_email(email)
+        if shard is None:
+            domains = ' or '.join(known.domain for known in SHARDS)
+            results[position] = (False, f"Please use an email address with the domain {domains}")
+            continue
+        # Courses are per campus; one only another campus has would be lost
+        if shard.name not in courses:
+            with use_shard(shard):
+                courses[shard.name] = set(get_all_courses())
+        if course not in courses[shard.name]:
+            results[position] = (False, f"The course {course} is not offered at your campus. Please choose another.")
+            continue
+        # Registrations come in bursts; the shared writer commits them in
+        # groups instead of one transaction (and one disk sync) each
+        future = get_write_queue(shard.db_path).submit_sql('''INSERT INTO pending_registrations (username, password, name, email, course_id)
+                                                           VALUES (?, ?, ?, ?, (SELECT id FROM courses WHERE name=?))''',
+                                                           (username, hash_password(password), name, email, course))
+        pending.append((position, future))
+    for position, future in pending:
+        try:
+            future.result()
+            results[position] = (True, "Registration submitted successfully! Please wait for admin approval.")
+        except IntegrityError:
+            results[position] = (False, "Username already exists. Please choose a different username.")
+        except (*OperationalError, RuntimeError):
+            # The whole group failed, or the writer stopped; not this registration
+            logger.exception('registration of %s could not be saved', registrations[position][0])
+            results[position] = (False, "Registration could not be saved right now. Please try again in a moment.")
+    return results
+
+def register_student(username, password, name, email, course):
+    return register_students([(username, password, name, email, course)])[0]
+
+def get_pending_registrations(fields=PENDING_LISTING_FIELDS):
+    with unit_of_work() as uow:
+        return uow.query(PENDING_REGISTRATIONS.select(fields))
+
+def approve_registration(registration_id):
+    with unit_of_work() as uow:
+        registration = uow.query_one(PENDING_REGISTRATIONS.select(['username', 'password', 'name', 'email', 'course_id'],
+                                                                  where='pending_registrations.id = ?'),
+                                     (registration_id,))
+        
+        if registration:
+            with uow.savepoint():
+                c = uow.execute('INSERT INTO users (username, password, is_admin) VALUES (?, ?, 0)',
+                                (registration['username'], registration['password']))
+                user_id = c.lastrowid
+                uow.execute('INSERT INTO students (user_id, name, email, course_id) VALUES (?, ?, ?, ?)',
+                            (user_id, registration['name'], registration['email'], registration['course_id']))
+                uow.execute('DELETE FROM pending_registrations WHERE id = ?', (registration_id,))
+        return registration is not None
+
+def add_course(course_name):
+    with unit_of_work() as uow:
+        try:
+            uow.execute('INSERT INTO courses (name) VALUES (?)', (course_name,))
+            return True
+        except IntegrityError:
+            return False
+
+def rename_course(old_name, new_name):
+    # Students and registrations point at the course id, so renaming is one row
+    with unit_of_work() as uow:
+        try:
+            uow.execute('UPDATE courses SET name = ? WHERE name = ?', (new_name, old_name))
+            return True
+        except IntegrityError:
+            return False
+
+def delete_course(course_name):
+    # ON DELETE SET NULL clears course_id on students and registrations
+    with unit_of_work() as uow:
+        uow.execute('DELETE FROM courses WHERE name = ?', (course_name,))
+
+# Deleting
+#
+# Deleting only stamps deleted_at on the students and their accounts, which
+# hides them from every listing and stops the accounts signing in at once,
+# in one small UPDATE. purge.py removes the rows and their files in batches
+# once the retention window has passed; until then they can be restored.
+
+# Ids per statement, under SQLite's old 999-parameter limit
+DELETE_CHUNK = 500
+
+def deleted_at_now():
+    # Same format as updated_at, so the two sort together
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+def _mark_deleted(uow, where, params, deleted_at):
+    # Accounts first, while the students still match where. Admins keep
+    # theirs even if they also have a student profile.
+    uow.execute(f'''UPDATE users SET deleted_at = ? WHERE deleted_at IS NULL AND COALESCE(is_admin, 0) = 0
+                    AND id IN (SELECT user_id FROM students WHERE {where})''', [deleted_at, *params])
+    return uow.execute(f'UPDATE students SET deleted_at = ? WHERE {where}', [deleted_at, *params]).rowcount
+
+def delete_students(student_ids):
+    # Returns how many students were deleted
+    student_ids = list(student_ids)
+    deleted_at = deleted_at_now()
+    deleted = 0
+    with unit_of_work() as uow:
+        for start in range(0, len(student_ids), DELETE_CHUNK):
+            chunk = student_ids[start:start + DELETE_CHUNK]
+            deleted += _mark_deleted(uow, f"id IN ({', '.join('?' * len(chunk))}) AND deleted_at IS NULL",
+                                     chunk, deleted_at)
+    return deleted
+
+def delete_student(student_id):
+    return delete_students([student_id]) == 1
+
+def get_deleted_students(fields=('id', 'name', 'email', 'course', 'deleted_at')):
+    # Deleted students not purged yet, most recently deleted first
+    with unit_of_work() as uow:
+        return uow.query(STUDENTS.select(list(fields), where='students.deleted_at IS NOT NULL',
+                                         order_by='students.deleted_at DESC'))
+
+def restore_students(student_ids):
+    # Undoes delete_students until the purge has run; returns how many came back
+    student_ids = list(student_ids)
+    restored = 0
+    with unit_of_work() as uow:
+        for start in range(0, len(student_ids), DELETE_CHUNK):
+            chunk = student_ids[start:start + DELETE_CHUNK]
+            id_list = ', '.join('?' * len(chunk))
+            uow.execute(f'''UPDATE users SET deleted_at = NULL WHERE deleted_at IS NOT NULL
+                            AND id IN (SELECT user_id FROM students WHERE id IN ({id_list}))''', chunk)
+            restored += uow.execute(f'''UPDATE students SET deleted_at = NULL
+                                        WHERE id IN ({id_list}) AND deleted_at IS NOT NULL''', chunk).rowcount
+    return restored
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
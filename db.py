@@ -0,0 +1,292 @@
+import sqlite3
+import threading
+import os
+import json
+import queue
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+# A file path for SQLite, or a postgresql:// URL to run on PostgreSQL
+DB_PATH = os.environ.get('DATABASE_URL', 'students.db')
+
+# Set QUERY_LOG to a file path to record every statement the app runs, for
+# index_advisor.py to replay. Only the SQL text and the number of parameters
+# are written, never the values.
+QUERY_LOG = os.environ.get('QUERY_LOG')
+_query_log_lock = threading.Lock()
+
+def log_query(sql, params):
+    if not QUERY_LOG:
+        return
+    line = json.dumps({'sql': sql, 'params': len(params)})
+    with _query_log_lock:
+        with open(QUERY_LOG, 'a') as f:
+            f.write(line + '\n')
+
+_local = threading.local()
+
+# Database setup
+#
+# DB_PATH is the default database. A thread can point itself at another one
+# (a campus shard, say) with use_database(); connections and units of work
+# opened on that thread then go to that file.
+def current_db_path():
+    return getattr(_local, 'db_path', None) or DB_PATH
+
+@contextmanager
+def use_database(path):
+    previous = getattr(_local, 'db_path', None)
+    _local.db_path = path
+    try:
+        yield path
+    finally:
+        _local.db_path = previous
+
+def is_postgres(path=None):
+    return (path or current_db_path()).startswith(('postgres://', 'postgresql://'))
+
+# Catch this rather than sqlite3.IntegrityError so either backend's
+# constraint violations are handled. Always a tuple, so it can be unpacked
+# into a longer except clause.
+try:
+    from psycopg2 import IntegrityError as _PostgresIntegrityError
+    IntegrityError = (sqlite3.IntegrityError, _PostgresIntegrityError)
+except ImportError:
+    IntegrityError = (sqlite3.IntegrityError,)
+
+# Likewise for failures of the database rather than of one row, such as a
+# lock that was not released in time
+try:
+    from psycopg2 import OperationalError as _PostgresOperationalError
+    OperationalError = (sqlite3.OperationalError, _PostgresOperationalError)
+except ImportError:
+    OperationalError = (sqlite3.OperationalError,)
+
+# Case-insensitive substring search
+#
+# SQLite's LIKE folds only ASCII letters and reads % and _ in the search text
+# as wildcards. Searches match fold_case(column) against contains_pattern()
+# instead, which folds case with str.lower() as StudentDirectory does in
+# memory. PostgreSQL defines fold_case as lower() in its schema.
+def fold_case(value):
+    return value.lower() if isinstance(value, str) else value
+
+def contains_pattern(text):
+    # For LIKE ? ESCAPE '\'
+    escaped = text.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+def get_db_connection(path=None, check_same_thread=True):
+    path = path or current_db_path()
+    if is_postgres(path):
+        from postgres import PostgresConnection
+        return PostgresConnection(path)
+    conn = sqlite3.connect(path, check_same_thread=check_same_thread)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.create_function('fold_case', 1, fold_case, deterministic=True)
+    return conn
+
+# Connection pools
+#
+# Units of work borrow a connection from their database's pool and hand it
+# back when they finish, instead of opening and closing one per rerun or
+# request. Connections never cross threads while borrowed.
+POOL_SIZE = 8
+# Pooled connections live as long as the process, so instead of on close
+# each runs PRAGMA optimize on its way back to the pool, at most this often.
+# It looks at the tables the connection's own queries used.
+OPTIMIZE_INTERVAL = 60 * 60
+
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue(size)
+        # Connection -> when it was opened or last optimized
+        self._optimized = {}
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            conn = get_db_connection(self.path, check_same_thread=False)
+            # Transactions are managed by hand in UnitOfWork
+            conn.isolation_level = None
+            self._optimized[conn] = time.monotonic()
+            return conn
+
+    def _optimize(self, conn, force=False):
+        # Cheap when there is nothing to do; lets SQLite refresh statistics
+        # for tables this connection's queries found lacking
+        if is_postgres(self.path):
+            return
+        now = time.monotonic()
+        if force or now - self._optimized.get(conn, now) >= OPTIMIZE_INTERVAL:
+            conn.execute('PRAGMA optimize')
+            self._optimized[conn] = now
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        self._optimize(conn)
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            self._optimize(conn, force=True)
+            self._optimized.pop(conn, None)
+            conn.close()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(path=None):
+    path = path or current_db_path()
+    with _pools_lock:
+        if path not in _pools:
+            _pools[path] = ConnectionPool(path)
+        return _pools[path]
+
+# Query to DataFrame
+#
+# Builds a frame column by column straight from the cursor's tuples, instead
+# of going through sqlite3.Row objects and dicts. Low-cardinality columns
+# become categoricals and text columns Arrow-backed strings, both far smaller
+# than the object columns pandas would otherwise infer.
+def frame_from_cursor(cursor, categories=(), strings=()):
+    # Server-side cursors only describe their columns once rows are fetched
+    rows = cursor.fetchall()
+    columns = [description[0] for description in cursor.description]
+    values = zip(*rows) if rows else [()] * len(columns)
+    data = {}
+    for name, column in zip(columns, values):
+        if name in categories:
+            dtype = 'category'
+        elif name in strings:
+            dtype = 'string[pyarrow]'
+        else:
+            dtype = None
+        data[name] = pd.Series(column, dtype=dtype)
+    return pd.DataFrame(data, columns=columns)
+
+# Unit of work
+#
+# A Streamlit rerun (or a fragment rerun) opens one UnitOfWork. All reads in
+# that rerun share a single connection and a single read transaction, so every
+# tab sees the same snapshot, and identical queries are only run once. Writes
+# are collected in one write transaction and committed when the rerun ends.
+class UnitOfWork:
+    def __init__(self, path=None):
+        self.pool = get_pool(path)
+        self.conn = self.pool.acquire()
+        self._cache = {}
+        self._writing = False
+
+    def _begin_read(self):
+        if not self.conn.in_transaction:
+            self.conn.execute('BEGIN')
+
+    def _begin_write(self):
+        if self._writing:
+            return
+        # Upgrading a read snapshot to a writer fails if someone else committed
+        # in the meantime, so end the read and take the write lock up front
+        if self.conn.in_transaction:
+            self.conn.execute('COMMIT')
+        self.conn.execute('BEGIN IMMEDIATE')
+        self._writing = True
+
+    def query(self, sql, params=()):
+        key = (sql, tuple(params))
+        if key not in self._cache:
+            self._begin_read()
+            log_query(sql, params)
+            self._cache[key] = self.conn.execute(sql, params).fetchall()
+        return self._cache[key]
+
+    def query_frame(self, sql, params=(), categories=(), strings=()):
+        key = ('frame', sql, tuple(params), tuple(categories), tuple(strings))
+        if key not in self._cache:
+            self._begin_read()
+            log_query(sql, params)
+            cursor = self.conn.cursor()
+            # Plain tuples are all the frame builder needs
+            cursor.row_factory = None
+            try:
+                self._cache[key] = frame_from_cursor(cursor.execute(sql, params), categories, strings)
+            finally:
+                # Frees PostgreSQL's server-side cursor now, not at disconnect
+                cursor.close()
+        return self._cache[key]
+
+    def query_one(self, sql, params=()):
+        rows = self.query(sql, params)
+        return rows[0] if rows else None
+
+    def execute(self, sql, params=()):
+        self._begin_write()
+        # Anything memoized so far may be stale now
+        self._cache.clear()
+        log_query(sql, params)
+        return self.conn.execute(sql, params)
+
+    @contextmanager
+    def savepoint(self):
+        # Group several writes so a failure undoes only this group
+        self._begin_write()
+        self.conn.execute('SAVEPOINT unit_of_work')
+        try:
+            yield self
+        except BaseException:
+            self.conn.execute('ROLLBACK TO unit_of_work')
+            self.conn.execute('RELEASE unit_of_work')
+            self._cache.clear()
+            raise
+        else:
+            self.conn.execute('RELEASE unit_of_work')
+
+    def commit(self):
+        if self.conn.in_transaction:
+            self.conn.execute('COMMIT')
+        self._writing = False
+
+    def rollback(self):
+        if self.conn.in_transaction:
+            self.conn.execute('ROLLBACK')
+        self._writing = False
+        self._cache.clear()
+
+    def close(self):
+        self.pool.release(self.conn)
+        self.conn = None
+
+@contextmanager
+def unit_of_work():
+    # Join the unit of work already open on this thread for the current
+    # database, if any
+    path = current_db_path()
+    if not hasattr(_local, 'uows'):
+        _local.uows = {}
+    uow = _local.uows.get(path)
+    if uow is not None:
+        yield uow
+        return
+
+    uow = UnitOfWork(path)
+    _local.uows[path] = uow
+    try:
+        yield uow
+    except Exception:
+        uow.rollback()
+        raise
+    except BaseException:
+        # st.rerun() and st.stop() unwind the script with control-flow
+        # exceptions; the work done before them should still be kept
+        uow.commit()
+        raise
+    else:
+        uow.commit()
+    finally:
+        del _local.uows[path]
+        uow.close()
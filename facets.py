@@ -0,0 +1,123 @@
+"""Facet counts for the Student List: course, academic year, resume, photo.
+
+Counting each facet value separately would take a query per value. Instead
+one grouped query counts the students matching the search for every
+combination of facet values, and each facet's counts are summed from those
+groups in Python, applying the selections on the other facets only: the
+usual faceted-search behaviour, where picking a course still shows how many
+students every other course has.
+
+The grouped rows are cached per database and search; selections are applied
+to the cached groups, so picking facet values never queries again. The
+cache key includes the latest change_log version (see change_tracking.py),
+so any write to students makes the next lookup miss; reading that version
+is one row from sqlite_sequence.
+"""
+import threading
+from collections import OrderedDict
+
+from db import current_db_path, is_postgres, unit_of_work
+
+# Facet name -> SQL expression giving its value for a student row
+FACETS = {
+    'course': 'courses.name',
+    'academic_year': 'students.academic_year',
+    'has_resume': "CASE WHEN COALESCE(students.resume_path, '') <> '' THEN 1 ELSE 0 END",
+    'has_photo': "CASE WHEN COALESCE(students.photo_path, '') <> '' THEN 1 ELSE 0 END",
+}
+FACET_CACHE_SIZE = 256
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def facet_clause(filters, columns=None):
+    # WHERE clause for the selected facet values; filters maps a facet name
+    # to the values picked for it, and values within one facet are OR-ed.
+    # columns overrides FACETS for tables shaped differently from students.
+    clauses, params = [], []
+    for facet, values in (filters or {}).items():
+        if facet not in FACETS:
+            raise ValueError(f'Unknown facet: {facet}')
+        if not values:
+            continue
+        named = [value for value in values if value is not None]
+        placeholders = ', '.join('?' * len(named))
+        if columns:
+            column = columns[facet]
+            values_sql = f'({placeholders})'
+        elif facet == 'course':
+            # Through the course_id index rather than the joined name
+            column = 'students.course_id'
+            values_sql = f'(SELECT id FROM courses WHERE name IN ({placeholders}))'
+        else:
+            column = FACETS[facet]
+            values_sql = f'({placeholders})'
+        # None stands for students without a value, which IN never matches
+        alternatives = [f'{column} IN {values_sql}'] if named else []
+        if len(named) < len(values):
+            alternatives.append(f'{column} IS NULL')
+        clauses.append(f"({' OR '.join(alternatives)})")
+        params.extend(named)
+    return ' AND '.join(clauses), params
+
+def _ordered(counts):
+    # Most common values first; absent values (no course, no year) last
+    return sorted(counts.items(), key=lambda item: (item[0] is None, -item[1], str(item[0])))
+
+def _matches(group, filters, skip):
+    return all(group[facet] in values for facet, values in filters.items() if facet != skip)
+
+def _groups(where, params):
+    # Student counts for every combination of facet values, in one pass
+    selects = ', '.join(f'{sql} AS {facet}' for facet, sql in FACETS.items())
+    sql = (f'SELECT {selects}, COUNT(*) AS students FROM students '
+           f'LEFT JOIN courses ON courses.id = students.course_id WHERE {where} '
+           f"GROUP BY {', '.join(str(position) for position in range(1, len(FACETS) + 1))}")
+    with unit_of_work() as uow:
+        return [dict(row) for row in uow.query(sql, params)]
+
+def _cached_groups(where, params):
+    if is_postgres():
+        return _groups(where, params)
+    with unit_of_work() as uow:
+        row = uow.query_one("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'")
+    key = (current_db_path(), row['seq'] if row else 0, where, tuple(params))
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    groups = _groups(where, params)
+    with _cache_lock:
+        _cache[key] = groups
+        while len(_cache) > FACET_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return groups
+
+def facet_counts(where, params, filters=None):
+    # Counts for the students matching where (the search clause), as
+    # (total, {facet: [(value, count), ...]}), where total also applies
+    # every selected facet
+    return count_groups(_cached_groups(where, params), filters)
+
+def count_groups(groups, filters=None):
+    # facet_counts() from grouped rows: one dict per combination of facet
+    # values, with its number of students
+    filters = {facet: values for facet, values in (filters or {}).items() if values}
+    counts = {facet: {} for facet in FACETS}
+    for group in groups:
+        for facet in FACETS:
+            if _matches(group, filters, facet):
+                counts[facet][group[facet]] = counts[facet].get(group[facet], 0) + group['students']
+    total = sum(group['students'] for group in groups if _matches(group, filters, None))
+    return total, {facet: _ordered(values) for facet, values in counts.items()}
+
+
+def merge_facet_counts(results):
+    # Adds up facet_counts() results from several shards
+    total, merged = 0, {facet: {} for facet in FACETS}
+    for shard_total, counts in results:
+        total += shard_total
+        for facet, values in counts.items():
+            for value, count in values:
+                merged[facet][value] = merged[facet].get(value, 0) + count
+    return total, {facet: _ordered(values) for facet, values in merged.items()}
@@ -0,0 +1,145 @@
+"""In-memory index of the upload folders, kept current by filesystem events.
+
+Pages that list many students ask the index whether each photo and resume
+exists instead of calling stat for every one on every rerun. The folders are
+scanned once when the index starts; after that watchdog reports creations,
+changes, moves and deletions, and the index updates just those entries.
+Content hashes are computed on first request and kept until the file
+changes.
+"""
+import os
+import threading
+from collections import namedtuple
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from resume_bundles import file_sha256
+from shards import SHARDS
+from upload_gc import UPLOAD_DIRS, normalize
+
+FileInfo = namedtuple('FileInfo', ['size', 'mtime', 'sha256'])
+
+class _Handler(FileSystemEventHandler):
+    def __init__(self, index):
+        self.index = index
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.index.refresh(event.src_path)
+
+    on_modified = on_created
+    on_closed = on_created
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.index.forget(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.index.forget(event.src_path)
+            self.index.refresh(event.dest_path)
+
+class UploadIndex:
+    def __init__(self, directories=UPLOAD_DIRS):
+        self.roots = [normalize(directory) for directory in directories]
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._observer = None
+
+    def start(self):
+        # Watch before scanning, so a file written during the scan is not missed
+        self._observer = Observer()
+        handler = _Handler(self)
+        for root in self.roots:
+            os.makedirs(root, exist_ok=True)
+            self._observer.schedule(handler, root, recursive=False)
+        self._observer.daemon = True
+        self._observer.start()
+        for root in self.roots:
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        self.refresh(entry.path)
+        return self
+
+    def stop(self):
+        if self._observer:
+            self._observer.stop()
+            self._observer.join()
+
+    def watches(self, key):
+        return os.path.dirname(key) in self.roots
+
+    def refresh(self, path):
+        # Re-stat one file; called for events and by writers that can't wait
+        # for the event to arrive
+        key = normalize(path)
+        try:
+            stat = os.stat(key)
+        except OSError:
+            self.forget(key)
+            return
+        with self._lock:
+            current = self._entries.get(key)
+            if current is None or current[:2] != (stat.st_size, stat.st_mtime):
+                self._entries[key] = FileInfo(stat.st_size, stat.st_mtime, None)
+
+    def forget(self, path):
+        with self._lock:
+            self._entries.pop(normalize(path), None)
+
+    def info(self, path):
+        # FileInfo, or None if the file doesn't exist. Paths outside the
+        # watched folders fall back to stat.
+        if not path:
+            return None
+        key = normalize(path)
+        if self.watches(key):
+            return self._entries.get(key)
+        try:
+            stat = os.stat(key)
+        except OSError:
+            return None
+        return FileInfo(stat.st_size, stat.st_mtime, None)
+
+    def exists(self, path):
+        return self.info(path) is not None
+
+    def sha256(self, path):
+        info = self.info(path)
+        if info is None:
+            return None
+        if info.sha256 is None:
+            key = normalize(path)
+            info = info._replace(sha256=file_sha256(key))
+            with self._lock:
+                # Keep the hash only if the file hasn't changed meanwhile
+                current = self._entries.get(key)
+                if current is not None and current[:2] == info[:2]:
+                    self._entries[key] = info
+        return info.sha256
+
+    def __len__(self):
+        return len(self._entries)
+
+_upload_index = None
+_upload_index_lock = threading.Lock()
+
+def upload_changed(path):
+    # For code that writes, moves or removes an upload: updates this
+    # process's index if it has one, without starting one. A short-lived
+    # script would pay for the watcher and the full scan only to exit.
+    index = _upload_index
+    if index is not None:
+        index.refresh(path)
+
+def get_upload_index():
+    # One index per process, started on first use
+    global _upload_index
+    with _upload_index_lock:
+        if _upload_index is None:
+            # Every shard's upload folders
+            _upload_index = UploadIndex([os.path.join(shard.upload_root, directory)
+                                         for shard in SHARDS for directory in UPLOAD_DIRS]).start()
+    return _upload_index
@@ -0,0 +1,189 @@
+"""Batch student ID cards with QR codes, laid out on printable sheets.
+
+Each student's card is rendered once into a PNG tile named after a hash of
+everything printed on it (and the photo file's size and mtime), so reprinting
+an intake only renders the students whose details or photo changed. Tiles
+are rendered in worker processes and placed ten to an A4 sheet.
+
+    python id_cards.py --year "2023 - 2025" -o cards_2023.pdf
+    python id_cards.py --course MCA --shard rmp -o mca_rmp.pdf
+"""
+import argparse
+import functools
+import hashlib
+import json
+import os
+import time
+
+import qrcode
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfgen import canvas
+
+from db import unit_of_work
+from queries import STUDENTS, LIVE_STUDENTS
+from resume_archive import get_executor
+from shards import SHARDS, get_shard, init_shards, use_shard
+
+CARD_DIR = 'card_cache'
+# CR80 card size at 300 dpi
+CARD_SIZE = (1012, 638)
+CARD_WIDTH_MM = 85.6
+CARD_HEIGHT_MM = 54
+SHEET_COLUMNS = 2
+SHEET_ROWS = 5
+INSTITUTION = 'SRM Institute of Science and Technology'
+LOGO_PATH = 'assets/srmist.jpg'
+CARD_FIELDS = ['id', 'name', 'course', 'student_id', 'register_no', 'academic_year', 'photo_path']
+
+@functools.lru_cache(maxsize=None)
+def load_font(size):
+    for name in ('DejaVuSans.ttf', 'arial.ttf'):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            pass
+    return ImageFont.load_default()
+
+def file_signature(path):
+    # Size and mtime are enough to notice a replaced photo without reading it
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+def qr_payload(student):
+    # The register number, or else the student id, or else the row id
+    return student['register_no'] or student['student_id'] or str(student['id'])
+
+def card_key(student):
+    printed = {field: student[field] for field in CARD_FIELDS if field != 'id'}
+    printed['photo'] = file_signature(student['photo_path'])
+    printed['qr'] = qr_payload(student)
+    return hashlib.sha256(json.dumps(printed, sort_keys=True).encode()).hexdigest()
+
+def render_card(student, output_path):
+    # Runs in a worker process
+    width, height = CARD_SIZE
+    card = Image.new('RGB', CARD_SIZE, 'white')
+    draw = ImageDraw.Draw(card)
+
+    # Header band with the institution name
+    draw.rectangle([0, 0, width, 110], fill=(12, 45, 110))
+    if os.path.exists(LOGO_PATH):
+        with Image.open(LOGO_PATH) as logo:
+            logo = ImageOps.contain(logo.convert('RGB'), (90, 90))
+            card.paste(logo, (20, 10))
+    draw.text((130, 35), INSTITUTION, fill='white', font=load_font(34))
+
+    # Photo on the left
+    photo_box = (40, 150, 300, 480)
+    photo_path = student['photo_path']
+    if photo_path and os.path.exists(photo_path):
+        with Image.open(photo_path) as photo:
+            photo = ImageOps.fit(photo.convert('RGB'), (photo_box[2] - photo_box[0], photo_box[3] - photo_box[1]))
+            card.paste(photo, photo_box[:2])
+    else:
+        draw.rectangle(photo_box, outline=(150, 150, 150), width=3)
+        draw.text((photo_box[0] + 70, photo_box[1] + 150), 'No photo', fill=(150, 150, 150), font=load_font(28))
+
+    # Details in the middle
+    y = 160
+    draw.text((340, y), student['name'] or '', fill='black', font=load_font(44))
+    label_font, value_font = load_font(24), load_font(30)
+    for label, value in (('Course', student['course']), ('Student ID', student['student_id']),
+                         ('Register No', student['register_no']), ('Academic Year', student['academic_year'])):
+        y += 70
+        draw.text((340, y), label, fill=(90, 90, 90), font=label_font)
+        draw.text((340, y + 26), value or '-', fill='black', font=value_font)
+
+    # QR code on the right
+    code = qrcode.QRCode(border=1, box_size=8)
+    code.add_data(qr_payload(student))
+    code.make(fit=True)
+    qr = code.make_image(fill_color='black', back_color='white').get_image().convert('RGB')
+    qr = ImageOps.contain(qr, (220, 220))
+    card.paste(qr, (width - qr.width - 30, height - qr.height - 30))
+
+    card.save(output_path, 'PNG', optimize=False)
+    return output_path
+
+def intake_students(academic_year=None, course=None):
+    where, params = [LIVE_STUDENTS], []
+    if academic_year:
+        where.append('students.academic_year = ?')
+        params.append(academic_year)
+    if course:
+        where.append('students.course_id = (SELECT id FROM courses WHERE name = ?)')
+        params.append(course)
+    with unit_of_work() as uow:
+        rows = uow.query(STUDENTS.select(CARD_FIELDS, where=' AND '.join(where),
+                                         order_by='students.register_no, students.id'), params)
+    return [dict(row) for row in rows]
+
+def render_tiles(students, cache_dir=CARD_DIR):
+    # Returns (tile paths in student order, number of tiles rendered)
+    os.makedirs(cache_dir, exist_ok=True)
+    tiles = []
+    pending = {}
+    for student in students:
+        path = os.path.join(cache_dir, f'{card_key(student)}.png')
+        tiles.append(path)
+        if not os.path.exists(path) and path not in pending:
+            # Render under a temporary name; rename once complete
+            pending[path] = get_executor().submit(render_card, student, path + '.part')
+    for path, future in pending.items():
+        os.replace(future.result(), path)
+    return tiles, len(pending)
+
+def write_sheets(tiles, output_path):
+    pdf = canvas.Canvas(output_path, pagesize=A4)
+    page_width, page_height = A4
+    card_width, card_height = CARD_WIDTH_MM * mm, CARD_HEIGHT_MM * mm
+    gap = 4 * mm
+    left = (page_width - SHEET_COLUMNS * card_width - (SHEET_COLUMNS - 1) * gap) / 2
+    top = page_height - (page_height - SHEET_ROWS * card_height - (SHEET_ROWS - 1) * gap) / 2
+    per_sheet = SHEET_COLUMNS * SHEET_ROWS
+    for index, tile in enumerate(tiles):
+        slot = index % per_sheet
+        if index and not slot:
+            pdf.showPage()
+        row, column = divmod(slot, SHEET_COLUMNS)
+        x = left + column * (card_width + gap)
+        y = top - (row + 1) * card_height - row * gap
+        pdf.drawImage(tile, x, y, card_width, card_height)
+        # Thin cut line around each card
+        pdf.setLineWidth(0.3)
+        pdf.rect(x, y, card_width, card_height)
+    pdf.save()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--year', help='academic year (intake) to print')
+    parser.add_argument('--course', help='only students of this course')
+    parser.add_argument('--shard', help='only this campus (default: every campus, one after another)')
+    parser.add_argument('-o', '--output', default='id_cards.pdf')
+    args = parser.parse_args()
+    try:
+        shards = [get_shard(args.shard)] if args.shard else SHARDS
+    except KeyError as e:
+        parser.error(str(e))
+
+    init_shards()
+    started = time.perf_counter()
+    students = []
+    for shard in shards:
+        with use_shard(shard):
+            students.extend(intake_students(args.year, args.course))
+    if not students:
+        parser.exit(message='No students match.\n')
+    tiles, rendered = render_tiles(students)
+    write_sheets(tiles, args.output)
+    print(f'{len(students)} cards ({rendered} rendered, {len(students) - rendered} cached) '
+          f'on {-(-len(tiles) // (SHEET_COLUMNS * SHEET_ROWS))} sheets in {time.perf_counter() - started:.1f}s '
+          f'-> {args.output}')
+
+if __name__ == '__main__':
+    main()
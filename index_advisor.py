@@ -0,0 +1,98 @@
+"""Replay a query log through EXPLAIN QUERY PLAN and report full scans.
+
+Record a log by running the app with QUERY_LOG set, then:
+
+    QUERY_LOG=queries.jsonl streamlit run streamlit_app.py
+    python index_advisor.py queries.jsonl
+"""
+import argparse
+import json
+import re
+import sqlite3
+from collections import Counter
+
+import db
+
+def load_log(path):
+    counts = Counter()
+    params = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            counts[entry['sql']] += 1
+            params[entry['sql']] = entry['params']
+    return counts, params
+
+def explain(conn, sql, param_count):
+    # Plans don't depend on the bound values, so NULLs stand in for them
+    rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, [None] * param_count).fetchall()
+    return [row[3] for row in rows]
+
+def indexed_columns(conn, table):
+    # Leading column of every index on the table; only those can drive a search
+    leading = set()
+    for index in conn.execute(f'PRAGMA index_list({table})').fetchall():
+        columns = conn.execute(f'PRAGMA index_info({index[1]})').fetchall()
+        if columns:
+            leading.add(columns[0][2])
+    return leading
+
+def suggest_indexes(conn, sql, table):
+    # Columns of the scanned table compared with = or IN against a parameter
+    columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})').fetchall()}
+    filtered = re.findall(r'(?:(\w+)\.)?(\w+)\s*(?:=|\bIN\b)\s*\(?\s*\?', sql, re.IGNORECASE)
+    candidates = []
+    for qualifier, column in filtered:
+        if qualifier and qualifier != table:
+            continue
+        if column in columns and column not in candidates:
+            candidates.append(column)
+    existing = indexed_columns(conn, table)
+    return [column for column in candidates if column not in existing]
+
+def advise(conn, counts, params):
+    findings = []
+    for sql, count in counts.most_common():
+        try:
+            plan = explain(conn, sql, params[sql])
+        except sqlite3.Error as e:
+            findings.append((sql, count, [f'could not explain: {e}'], []))
+            continue
+        scans = [step for step in plan if step.startswith('SCAN ')]
+        if not scans:
+            continue
+        suggestions = []
+        for step in scans:
+            table = step.split()[1]
+            for column in suggest_indexes(conn, sql, table):
+                suggestions.append(f'CREATE INDEX idx_{table}_{column} ON {table}({column});')
+        if re.search(r"LIKE\s+\?", sql, re.IGNORECASE):
+            suggestions.append("LIKE '%...%' patterns cannot use a b-tree index")
+        findings.append((sql, count, scans, suggestions))
+    return findings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('log', help='query log written with QUERY_LOG')
+    parser.add_argument('--db', default=db.DB_PATH, help='database to plan against')
+    args = parser.parse_args()
+
+    counts, params = load_log(args.log)
+    conn = sqlite3.connect(args.db)
+    findings = advise(conn, counts, params)
+    conn.close()
+
+    print(f'{sum(counts.values())} statements, {len(counts)} distinct, {len(findings)} with full scans')
+    for sql, count, scans, suggestions in findings:
+        print()
+        print(f'[{count}x] ' + ' '.join(sql.split()))
+        for step in scans:
+            print(f'    plan: {step}')
+        for suggestion in suggestions:
+            print(f'    suggest: {suggestion}')
+
+if __name__ == '__main__':
+    main()
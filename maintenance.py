@@ -0,0 +1,215 @@
+"""Maintenance: deleted students, planner statistics, free pages, WAL checkpoints, orphaned uploads, change log.
+
+    python maintenance.py            # run every task once
+    python maintenance.py analyze vacuum
+    python maintenance.py --enable-incremental-vacuum
+
+Databases created before incremental auto_vacuum was the default need one
+full VACUUM to switch over. That rebuilds the whole file and holds off
+writers meanwhile, so it only runs when asked for on the command line; until
+then the vacuum task skips them.
+"""
+import argparse
+import logging
+import sqlite3
+import threading
+import time
+
+from change_tracking import prune_change_log
+from db import get_db_connection, is_postgres
+from purge import purge_deleted
+from shards import SHARDS, use_shard
+import upload_gc
+
+logger = logging.getLogger(__name__)
+
+# Pages released per incremental_vacuum step, and the pause between steps so
+# writers waiting on the lock get a turn
+VACUUM_STEP_PAGES = 256
+VACUUM_STEP_PAUSE = 0.05
+# Checkpoints normally run PASSIVE; once the WAL grows past this many pages
+# it is truncated so the file doesn't keep its high-water size
+WAL_TRUNCATE_PAGES = 10000
+# Rows sampled per index when the optimize task analyzes a table itself
+ANALYSIS_LIMIT = 1000
+
+# Tasks
+#
+# Each task takes an open connection and returns a short summary.
+
+def purge(conn):
+    # Before vacuum, which hands the freed pages back
+    students, accounts, files = purge_deleted(conn)
+    return f'{students} deleted students, {accounts} accounts and {files} files purged'
+
+def optimize(conn):
+    # PRAGMA optimize normally considers only the tables this connection's
+    # queries used, and this one has run none; 0x10000 (SQLite 3.46+) makes
+    # it check every table. Older versions ignore that bit, so there the
+    # tables that have indexes but no statistics yet are analyzed directly.
+    # Stale statistics are left to the daily analyze task.
+    if sqlite3.sqlite_version_info >= (3, 46):
+        conn.execute('PRAGMA optimize=0x10002')
+        return 'ok'
+    analyzed = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE name = 'sqlite_stat1'")}
+    if analyzed:
+        analyzed = {row[0] for row in conn.execute('SELECT DISTINCT tbl FROM sqlite_stat1')}
+    tables = [row[0] for row in conn.execute(
+        "SELECT DISTINCT tbl_name FROM sqlite_master WHERE type = 'index' AND tbl_name NOT LIKE 'sqlite_%'")
+        if row[0] not in analyzed]
+    conn.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+    for table in tables:
+        conn.execute(f'ANALYZE "{table}"')
+    return f"{len(tables)} tables analyzed"
+
+def analyze(conn):
+    conn.execute('ANALYZE')
+    return 'ok'
+
+def enable_incremental_vacuum(conn):
+    # auto_vacuum can only change on an existing database through a full
+    # VACUUM, so this is done once, from the command line
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        return 'already incremental'
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    return 'switched to incremental'
+
+def incremental_vacuum(conn, max_steps=40):
+    freed = 0
+    for _ in range(max_steps):
+        free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if not free_pages:
+            break
+        step = min(free_pages, VACUUM_STEP_PAGES)
+        # execute() only steps the pragma once, which frees a single page;
+        # executescript() runs it to completion
+        conn.executescript(f'PRAGMA incremental_vacuum({step})')
+        freed += step
+        time.sleep(VACUUM_STEP_PAUSE)
+    return f'{freed} pages freed'
+
+def vacuum(conn):
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        return 'skipped: run maintenance.py --enable-incremental-vacuum first'
+    return incremental_vacuum(conn)
+
+def checkpoint(conn):
+    busy, wal_pages, moved = conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+    if wal_pages > WAL_TRUNCATE_PAGES and not busy:
+        busy, wal_pages, moved = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+    return f'{moved}/{wal_pages} WAL pages checkpointed' + (' (busy)' if busy else '')
+
+def collect_uploads(conn):
+    removed, freed = upload_gc.collect(conn)
+    return f'{removed} orphaned uploads removed ({freed} bytes)'
+
+def prune_changes(conn):
+    # Views that fell further behind than the retention reload in full
+    return f'{prune_change_log(conn)} change log entries pruned'
+
+# PostgreSQL runs its own autovacuum and statistics, so on a PostgreSQL
+# database only these tasks apply
+POSTGRES_TASKS = {'purge', 'uploads'}
+
+TASKS = {
+    'purge': purge,
+    'optimize': optimize,
+    'analyze': analyze,
+    'vacuum': vacuum,
+    'checkpoint': checkpoint,
+    'uploads': collect_uploads,
+    'changes': prune_changes,
+}
+
+def run_tasks(names):
+    conn = get_db_connection()
+    # PRAGMAs such as VACUUM refuse to run inside a transaction
+    conn.isolation_level = None
+    report = []
+    try:
+        for name in names:
+            if is_postgres() and name not in POSTGRES_TASKS:
+                continue
+            started = time.perf_counter()
+            result = TASKS[name](conn)
+            elapsed = time.perf_counter() - started
+            logger.info('maintenance %s: %s in %.3fs', name, result, elapsed)
+            report.append((name, result, elapsed))
+    finally:
+        conn.close()
+    return report
+
+# Background scheduler
+#
+# Each task has its own interval in seconds; the thread wakes up every
+# `tick` seconds and runs whatever is due.
+DEFAULT_SCHEDULE = {
+    'purge': 60 * 60,
+    'checkpoint': 5 * 60,
+    'optimize': 60 * 60,
+    'vacuum': 6 * 60 * 60,
+    'analyze': 24 * 60 * 60,
+    'uploads': 24 * 60 * 60,
+    'changes': 60 * 60,
+}
+
+class MaintenanceThread(threading.Thread):
+    def __init__(self, schedule=None, tick=30):
+        super().__init__(name='db-maintenance', daemon=True)
+        self.schedule = schedule or DEFAULT_SCHEDULE
+        self.tick = tick
+        self.last_run = {name: time.monotonic() for name in self.schedule}
+        # Shard name -> report of the last run
+        self.last_report = {}
+        self._stopping = threading.Event()
+
+    def run(self):
+        while not self._stopping.wait(self.tick):
+            now = time.monotonic()
+            due = [name for name, interval in self.schedule.items() if now - self.last_run[name] >= interval]
+            if not due:
+                continue
+            for shard in SHARDS:
+                try:
+                    with use_shard(shard):
+                        self.last_report[shard.name] = run_tasks(due)
+                except Exception:
+                    logger.exception('database maintenance failed on shard %s', shard.name)
+            for name in due:
+                self.last_run[name] = now
+
+    def stop(self):
+        self._stopping.set()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('tasks', nargs='*', help=f"tasks to run: {', '.join(TASKS)} (default: all)")
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help='switch older databases to incremental auto_vacuum with one full VACUUM')
+    args = parser.parse_args()
+    unknown = [name for name in args.tasks if name not in TASKS]
+    if unknown:
+        parser.error(f"unknown task: {', '.join(unknown)}")
+
+    if args.enable_incremental_vacuum:
+        for shard in SHARDS:
+            if is_postgres(shard.db_path):
+                continue
+            with use_shard(shard):
+                conn = get_db_connection()
+                conn.isolation_level = None
+                try:
+                    print(f'{shard.name:<10} {enable_incremental_vacuum(conn)}')
+                finally:
+                    conn.close()
+        if not args.tasks:
+            return
+
+    for shard in SHARDS:
+        with use_shard(shard):
+            for name, result, elapsed in run_tasks(args.tasks or list(TASKS)):
+                print(f'{shard.name:<10} {name:<12} {elapsed * 1000:8.1f} ms  {result}')
+
+if __name__ == '__main__':
+    main()
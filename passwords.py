@@ -0,0 +1,9 @@
+"""Password hashing, kept apart so worker processes can import it cheaply."""
+import hashlib
+
+def hash_password(password):
+    return hashlib.sha256(str.encode(password)).hexdigest()
+
+def hash_passwords(passwords):
+    # One batch per worker task; None (no password given) stays None
+    return [hash_password(password) if password else None for password in passwords]
@@ -0,0 +1,112 @@
+"""Copy a SQLite portal database into PostgreSQL with COPY.
+
+The SQLite file is brought up to date with the app's migrations first, then
+each table is streamed into PostgreSQL with COPY FROM STDIN, parents before
+children, all in one transaction: either everything arrives or nothing does.
+Identity sequences are moved past the copied ids afterwards, so new rows
+don't collide with old ones.
+
+    python pg_migrate.py postgresql://portal@localhost/portal
+    python pg_migrate.py --sqlite shards/rmp.db --replace postgresql://portal@localhost/rmp
+"""
+import argparse
+import io
+import time
+
+import db
+from postgres import PostgresConnection
+from schema import init_db
+
+# Parents first, so foreign keys hold as each table arrives
+TABLES = {
+    'users': ['id', 'username', 'password', 'is_admin', 'deleted_at'],
+    'courses': ['id', 'name'],
+    'students': ['id', 'user_id', 'name', 'email', 'course_id', 'student_id', 'register_no', 'academic_year',
+                 'resume_path', 'resume_sha256', 'photo_path', 'deleted_at'],
+    'pending_registrations': ['id', 'username', 'password', 'name', 'email', 'course_id'],
+}
+BATCH_ROWS = 10000
+
+def copy_field(value):
+    # COPY's text format: \N for NULL, and backslash escapes for the
+    # characters that separate fields and rows
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+class CopyStream(io.RawIOBase):
+    # A file-like view of a query's rows in COPY text format, produced a
+    # batch at a time as PostgreSQL reads
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.rows = 0
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while not self._buffer:
+            batch = self.cursor.fetchmany(BATCH_ROWS)
+            if not batch:
+                return 0
+            self.rows += len(batch)
+            self._buffer = ''.join('\t'.join(copy_field(value) for value in row) + '\n'
+                                   for row in batch).encode('utf-8')
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+def copy_table(source, target, table, columns):
+    cursor = source.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id")
+    stream = CopyStream(cursor)
+    with target.raw.cursor() as pg_cursor:
+        pg_cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", stream, size=1024 * 1024)
+        # Next generated id follows the highest copied one
+        pg_cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 0) + 1, false) "
+                          f'FROM {table}')
+    return stream.rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('url', help='postgresql:// URL of the target database')
+    parser.add_argument('--sqlite', default='students.db', help='SQLite database to copy')
+    parser.add_argument('--replace', action='store_true', help='empty the target tables first')
+    args = parser.parse_args()
+    if not db.is_postgres(args.url):
+        parser.error('target must be a postgresql:// URL')
+
+    with db.use_database(args.sqlite):
+        init_db()
+    with db.use_database(args.url):
+        init_db()
+
+    source = db.get_db_connection(args.sqlite)
+    # Plain tuples; nothing reads columns by name here
+    source.row_factory = None
+    target = PostgresConnection(args.url)
+    started = time.perf_counter()
+    total = 0
+    target.execute('BEGIN')
+    try:
+        if args.replace:
+            target.execute(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE")
+        for table, columns in TABLES.items():
+            table_started = time.perf_counter()
+            rows = copy_table(source, target, table, columns)
+            total += rows
+            print(f'{table:<24} {rows:>9} rows in {time.perf_counter() - table_started:.2f}s')
+        target.execute('COMMIT')
+    except Exception:
+        target.execute('ROLLBACK')
+        raise
+    finally:
+        source.close()
+        target.close()
+    elapsed = time.perf_counter() - started
+    print(f'{total} rows in {elapsed:.2f}s ({total / elapsed if elapsed else 0:,.0f} rows/s)')
+
+if __name__ == '__main__':
+    main()
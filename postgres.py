@@ -0,0 +1,160 @@
+"""PostgreSQL connections that behave like the app's sqlite3 connections.
+
+The data layer is written against sqlite3: qmark parameters, execute() on
+the connection, rows readable by name and position, lastrowid after an
+INSERT and BEGIN IMMEDIATE for writes. PostgresConnection wraps a psycopg2
+connection and translates just those points, so db.py, the data functions
+and the write queue run unchanged when DB_PATH (or a shard's db) is a
+postgresql:// URL. Large listings read through server-side cursors, so the
+server streams rows in batches instead of sending the whole result at once.
+"""
+import itertools
+import re
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+
+IntegrityError = psycopg2.IntegrityError
+
+# Rows fetched per round trip from a server-side cursor
+ITERSIZE = 5000
+
+_TOKENS = re.compile(r"'(?:[^']|'')*'|\?|%|\bLIKE\b", re.IGNORECASE)
+_cursor_names = itertools.count()
+
+def is_postgres_url(path):
+    return path.startswith(('postgres://', 'postgresql://'))
+
+def _translate_token(match):
+    token = match.group(0)
+    if token.startswith("'"):
+        # psycopg2 reads % as a placeholder even inside string literals
+        return token.replace('%', '%%')
+    if token == '?':
+        return '%s'
+    if token == '%':
+        return '%%'
+    # SQLite's LIKE ignores ASCII case; PostgreSQL's doesn't
+    return 'ILIKE'
+
+def translate(sql):
+    return _TOKENS.sub(_translate_token, sql)
+
+class Cursor:
+    # The parts of sqlite3.Cursor the app uses
+    def __init__(self, cursor, lastrowid=None):
+        self._cursor = cursor
+        self.lastrowid = lastrowid
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=ITERSIZE):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+class ServerCursor:
+    # Returned by PostgresConnection.cursor(), which the app uses for
+    # listings read into DataFrames; row_factory is accepted and ignored
+    def __init__(self, conn):
+        self._conn = conn
+        self._cursor = None
+        self.row_factory = None
+
+    def execute(self, sql, params=()):
+        # A WITH HOLD cursor outlives its transaction and keeps its results
+        # on the server until closed
+        self.close()
+        if not self._conn.in_transaction:
+            # Server-side cursors live inside a transaction
+            self._conn.execute('BEGIN')
+        # withhold: psycopg2 refuses named cursors on an autocommit
+        # connection otherwise, even inside an explicit BEGIN
+        self._cursor = self._conn.raw.cursor(name=f'listing_{next(_cursor_names)}', withhold=True)
+        self._cursor.itersize = ITERSIZE
+        self._cursor.execute(translate(sql), tuple(params))
+        return Cursor(self._cursor)
+
+    def close(self):
+        if self._cursor is not None and not self._cursor.closed:
+            self._cursor.close()
+        self._cursor = None
+
+class PostgresConnection:
+    def __init__(self, url):
+        self.raw = psycopg2.connect(url, cursor_factory=psycopg2.extras.DictCursor)
+        # Transactions are begun and ended explicitly, as with sqlite3 in
+        # isolation_level=None mode
+        self.raw.autocommit = True
+        self.row_factory = None
+        self.isolation_level = None
+
+    @property
+    def in_transaction(self):
+        return self.raw.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def execute(self, sql, params=()):
+        statement = sql.strip().upper()
+        if statement == 'BEGIN':
+            # A read transaction sees one snapshot throughout, like SQLite's
+            sql = 'BEGIN ISOLATION LEVEL REPEATABLE READ'
+        elif statement == 'BEGIN IMMEDIATE':
+            sql = 'BEGIN'
+        elif statement.startswith('PRAGMA'):
+            raise psycopg2.NotSupportedError(f'{sql} is SQLite-only')
+        returning = statement.startswith('INSERT') and 'RETURNING' not in statement
+        if returning:
+            # sqlite3 reports the new row's id as lastrowid
+            sql = f'{sql} RETURNING id'
+        cursor = self.raw.cursor()
+        if statement.startswith(('INSERT', 'UPDATE', 'DELETE')) and self.in_transaction:
+            # A failed statement aborts a PostgreSQL transaction, while SQLite
+            # undoes only that statement; the app catches IntegrityError and
+            # carries on, so writes get SQLite's behaviour via a savepoint
+            with self.raw.cursor() as savepoint:
+                savepoint.execute('SAVEPOINT statement')
+                try:
+                    cursor.execute(translate(sql), tuple(params))
+                except psycopg2.Error:
+                    savepoint.execute('ROLLBACK TO SAVEPOINT statement')
+                    raise
+                finally:
+                    savepoint.execute('RELEASE SAVEPOINT statement')
+        else:
+            cursor.execute(translate(sql), tuple(params))
+        lastrowid = None
+        if returning:
+            row = cursor.fetchone()
+            lastrowid = row[0] if row else None
+        return Cursor(cursor, lastrowid)
+
+    def cursor(self):
+        return ServerCursor(self)
+
+    def commit(self):
+        if self.in_transaction:
+            self.execute('COMMIT')
+
+    def rollback(self):
+        if self.in_transaction:
+            self.execute('ROLLBACK')
+
+    def close(self):
+        self.raw.close()
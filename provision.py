@@ -0,0 +1,257 @@
+"""Create or update user accounts in bulk from a registrar export.
+
+Reads CSV with a header row, or JSON Lines. Every record needs a username;
+a password is required for new accounts and optional for existing ones,
+which keep theirs when it is left out. role is admin (or staff) for
+administrators or student; left out, new accounts are students and existing
+ones keep their role. Passwords are taken as given, spaces included. Student
+records may also carry name,
+email, course, student_id, register_no and academic_year, which create or
+update the student's profile; students are placed on the campus their
+email's domain belongs to.
+
+Accounts are matched by username, so running the same file again changes
+nothing. Records are written in chunks, each its own transaction, and a
+record that breaks a constraint is reported and skipped without failing its
+chunk. Passwords are hashed in worker processes while earlier chunks are
+written. --dry-run goes through every step and rolls each chunk back.
+
+    python provision.py registrar_export.csv
+    python provision.py --dry-run staff.jsonl
+    python provision.py --admin admin
+"""
+import argparse
+import csv
+import getpass
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from db import IntegrityError, unit_of_work
+from passwords import hash_passwords
+from queries import USERS, STUDENTS
+from shards import get_shard, init_shards, shard_for_email, use_shard
+
+# Records per transaction; also keeps each IN (...) under SQLite's old
+# 999-parameter limit
+CHUNK_SIZE = 500
+# Below this many passwords, starting worker processes costs more than it saves
+PARALLEL_MIN_PASSWORDS = 20000
+ADMIN_ROLES = {'admin', 'staff'}
+ROLES = ADMIN_ROLES | {'student'}
+PROFILE_FIELDS = ['name', 'email', 'course', 'student_id', 'register_no', 'academic_year']
+
+def read_records(path, fmt=None):
+    # Yields (line number, raw record). JSON Lines records are yielded as
+    # text and decoded by parse_record, so a bad line is reported, not fatal.
+    fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if fmt == 'csv':
+            # Line 1 is the header
+            yield from enumerate(csv.DictReader(f), start=2)
+        else:
+            for line, text in enumerate(f, start=1):
+                if text.strip():
+                    yield line, text
+
+def parse_record(line, raw):
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise ValueError(f'not valid JSON: {e}')
+        if not isinstance(raw, dict):
+            raise ValueError('expected a JSON object')
+    record = {}
+    for key, value in raw.items():
+        if key is None:
+            continue
+        key = key.strip().lower()
+        value = str(value) if value is not None else ''
+        if key != 'password':
+            value = value.strip()
+        record[key] = value or None
+    if not record.get('username'):
+        raise ValueError('username is missing')
+    role = record.get('role') and record['role'].lower()
+    if role is not None and role not in ROLES:
+        raise ValueError(f'unknown role {role!r}')
+    profile = {field: record.get(field) for field in PROFILE_FIELDS}
+    return {
+        'line': line,
+        'username': record['username'],
+        'password': record.get('password'),
+        # None keeps an existing account's role
+        'is_admin': None if role is None else int(role in ADMIN_ROLES),
+        # Only students have a profile
+        'profile': profile if role not in ADMIN_ROLES and any(profile.values()) else None,
+    }
+
+def save_profile(uow, user_id, profile, current):
+    # Fields left out of the record keep their stored values. Returns the
+    # profile as now stored, or None if nothing had to change.
+    given = {field: value for field, value in profile.items() if value is not None}
+    if current is None:
+        values = [profile[field] for field in PROFILE_FIELDS]
+        student_id = uow.execute(
+            '''INSERT INTO students (user_id, name, email, course_id, student_id, register_no, academic_year)
+               VALUES (?, ?, ?, (SELECT id FROM courses WHERE name = ?), ?, ?, ?)''', [user_id, *values]).lastrowid
+        return {'id': student_id, 'user_id': user_id, **profile}
+    if all(current[field] == value for field, value in given.items()):
+        return None
+    assignments = ', '.join('course_id = (SELECT id FROM courses WHERE name = ?)' if field == 'course'
+                            else f'{field} = ?' for field in given)
+    uow.execute(f'UPDATE students SET {assignments} WHERE id = ?', [*given.values(), current['id']])
+    return {**current, **given}
+
+def provision_chunk(records, hashes, dry_run=False):
+    # Creates or updates one chunk's accounts in one transaction on the
+    # current shard. Returns (Counter of outcomes, [(line, error)]).
+    stats, errors = Counter(), []
+    with unit_of_work() as uow:
+        courses = {row['name'] for row in uow.query('SELECT name FROM courses')}
+        usernames = [record['username'] for record in records]
+        existing = {row['username']: dict(row) for row in uow.query(
+            USERS.select(['id', 'username', 'password', 'is_admin', 'deleted_at'],
+                         where=f"users.username IN ({', '.join('?' * len(usernames))})"), usernames)}
+        user_ids = [user['id'] for user in existing.values()]
+        profiles = {}
+        if user_ids:
+            profiles = {row['user_id']: dict(row) for row in uow.query(
+                STUDENTS.select(['id', 'user_id', *PROFILE_FIELDS],
+                                where=f"students.user_id IN ({', '.join('?' * len(user_ids))})"), user_ids)}
+
+        for record, password in zip(records, hashes):
+            current = existing.get(record['username'])
+            profile = record['profile']
+            try:
+                if profile and profile['course'] and profile['course'] not in courses:
+                    raise ValueError(f"unknown course {profile['course']!r}")
+                with uow.savepoint():
+                    if current is None:
+                        if password is None:
+                            raise ValueError('a password is required for a new account')
+                        is_admin = record['is_admin'] or 0
+                        user_id = uow.execute('INSERT INTO users (username, password, is_admin) VALUES (?, ?, ?)',
+                                              (record['username'], password, is_admin)).lastrowid
+                        outcome = 'created'
+                    elif current['deleted_at']:
+                        raise ValueError('the account was deleted; restore it or wait for the purge')
+                    else:
+                        user_id = current['id']
+                        password = password or current['password']
+                        is_admin = current['is_admin'] if record['is_admin'] is None else record['is_admin']
+                        outcome = 'unchanged'
+                        if (password, is_admin) != (current['password'], current['is_admin']):
+                            uow.execute('UPDATE users SET password = ?, is_admin = ? WHERE id = ?',
+                                        (password, is_admin, user_id))
+                            outcome = 'updated'
+                    saved = profile and save_profile(uow, user_id, profile, profiles.get(user_id))
+            except (ValueError, *IntegrityError) as e:
+                stats['failed'] += 1
+                errors.append((record['line'], str(e)))
+                continue
+            # A later record for the same username in this chunk sees this one
+            existing[record['username']] = {'id': user_id, 'username': record['username'], 'password': password,
+                                            'is_admin': is_admin, 'deleted_at': None}
+            if saved:
+                profiles[user_id] = saved
+                if outcome == 'unchanged':
+                    outcome = 'updated'
+            stats[outcome] += 1
+        if dry_run:
+            uow.rollback()
+    return stats, errors
+
+def chunked(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+def provision(records, dry_run=False, chunk_size=CHUNK_SIZE, workers=None):
+    # records: parsed records, each with a 'shard'. Returns (Counter, errors).
+    by_shard = {}
+    for record in records:
+        by_shard.setdefault(record['shard'], []).append(record)
+    chunks = [(shard, chunk) for shard, shard_records in by_shard.items()
+              for chunk in chunked(shard_records, chunk_size)]
+    passwords = [[record['password'] for record in chunk] for _, chunk in chunks]
+
+    executor = None
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(records) >= PARALLEL_MIN_PASSWORDS:
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        # Results arrive in order while earlier chunks are being written
+        hashed = executor.map(hash_passwords, passwords)
+    else:
+        hashed = map(hash_passwords, passwords)
+
+    totals, errors = Counter(), []
+    try:
+        for (shard, chunk), hashes in zip(chunks, hashed):
+            with use_shard(shard):
+                stats, chunk_errors = provision_chunk(chunk, hashes, dry_run)
+            totals.update(stats)
+            errors.extend(chunk_errors)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return totals, errors
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', nargs='?', help='CSV or JSON Lines file of accounts')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='file format (default: from the extension)')
+    parser.add_argument('--admin', metavar='USERNAME', help='create or reset one admin account, asking for its password')
+    parser.add_argument('--shard', help='campus for accounts without an email (default: the first)')
+    parser.add_argument('--dry-run', action='store_true', help='report what would change without saving it')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='accounts per transaction')
+    parser.add_argument('--workers', type=int, help='password hashing processes (default: one per CPU)')
+    args = parser.parse_args()
+    if bool(args.path) == bool(args.admin):
+        parser.error('give either a file or --admin')
+    try:
+        default_shard = get_shard(args.shard) if args.shard else get_shard()
+    except KeyError as e:
+        parser.error(str(e))
+
+    init_shards()
+    started = time.perf_counter()
+    records, errors = [], []
+    if args.admin:
+        password = getpass.getpass(f'Password for {args.admin}: ')
+        if password != getpass.getpass('Repeat it: '):
+            parser.error('passwords do not match')
+        raws = [(0, {'username': args.admin, 'password': password, 'role': 'admin'})]
+    else:
+        raws = read_records(args.path, args.format)
+    for line, raw in raws:
+        try:
+            record = parse_record(line, raw)
+        except ValueError as e:
+            errors.append((line, str(e)))
+            continue
+        email = record['profile'] and record['profile']['email']
+        record['shard'] = shard_for_email(email) if email else default_shard
+        if record['shard'] is None:
+            errors.append((line, f'no campus for the email domain of {email}'))
+            continue
+        records.append(record)
+
+    totals, write_errors = provision(records, dry_run=args.dry_run, chunk_size=args.chunk_size, workers=args.workers)
+    errors.extend(write_errors)
+    elapsed = time.perf_counter() - started
+
+    for line, message in sorted(errors)[:20]:
+        print(f'line {line}: {message}')
+    if len(errors) > 20:
+        print(f'... and {len(errors) - 20} more errors')
+    processed = sum(totals.values()) + len(errors) - len(write_errors)
+    print(f"{'Would provision' if args.dry_run else 'Provisioned'} {processed} accounts: "
+          f"{totals['created']} created, {totals['updated']} updated, {totals['unchanged']} unchanged, "
+          f'{len(errors)} failed '
+          f'in {elapsed:.1f}s ({processed / elapsed if elapsed else 0:,.0f} accounts/s)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Remove deleted students for good: their rows, accounts and uploaded files.
+
+Deleting a student in the admin view only stamps deleted_at (see
+data.delete_students). Once the retention window has passed, the purge
+removes the students and their accounts in batches, each its own short
+write transaction with a pause in between so the app's writers get the lock
+in turn. Their resumes and photos are removed after the batch commits, except
+files another student still refers to; if the purge stops in between, the
+files left behind are unreferenced and upload_gc.py collects them.
+maintenance.py runs the purge in the background.
+
+    python purge.py --dry-run
+    python purge.py --retention-hours 0
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from db import get_db_connection
+from file_index import upload_changed
+from shards import SHARDS, use_shard
+from upload_gc import mark, normalize
+
+logger = logging.getLogger(__name__)
+
+# How long deleted students can still be restored
+RETENTION = 7 * 24 * 60 * 60
+# Students removed per transaction, and the pause between transactions
+PURGE_BATCH = 500
+PURGE_PAUSE = 0.05
+
+def cutoff(retention=RETENTION):
+    # Students deleted before this are due; same format as deleted_at
+    moment = datetime.now(timezone.utc) - timedelta(seconds=retention)
+    return moment.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    upload_changed(path)
+    return True
+
+def purge_batch(conn, rows, before):
+    # Deletes one batch in its own transaction; returns (students, accounts,
+    # files) removed
+    ids = [row['id'] for row in rows]
+    user_ids = [row['user_id'] for row in rows if row['user_id'] is not None]
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Restored since they were read: deleted_at was cleared
+        students = conn.execute(f"DELETE FROM students WHERE id IN ({', '.join('?' * len(ids))}) "
+                                'AND deleted_at < ?', [*ids, before]).rowcount
+        accounts = 0
+        if user_ids:
+            # Only accounts that were deleted with their student, and have no
+            # other student row left
+            accounts = conn.execute(f'''DELETE FROM users WHERE id IN ({', '.join('?' * len(user_ids))})
+                                        AND deleted_at IS NOT NULL AND COALESCE(is_admin, 0) = 0
+                                        AND NOT EXISTS (SELECT 1 FROM students WHERE students.user_id = users.id)''',
+                                    user_ids).rowcount
+        # Read in the same transaction, so a student restored or saved in the
+        # meantime keeps a file the batch shares with them
+        paths = {normalize(path): path for row in rows for path in (row['resume_path'], row['photo_path']) if path}
+        referenced = mark(conn) if paths else set()
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    files = sum(remove_file(path) for key, path in paths.items() if key not in referenced)
+    return students, accounts, files
+
+def purge_deleted(conn=None, retention=RETENTION, batch_size=PURGE_BATCH, pause=PURGE_PAUSE, dry_run=False):
+    # Purges the current shard; returns (students, accounts, files) removed,
+    # or for a dry run the number of students due and zeros
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+        conn.isolation_level = None
+    before = cutoff(retention)
+    totals = [0, 0, 0]
+    try:
+        if dry_run:
+            due = conn.execute('SELECT COUNT(*) FROM students WHERE deleted_at IS NOT NULL AND deleted_at < ?',
+                               (before,)).fetchone()[0]
+            return due, 0, 0
+        while True:
+            # Oldest first, through the partial index on deleted_at
+            rows = conn.execute('''SELECT id, user_id, resume_path, photo_path FROM students
+                                   WHERE deleted_at IS NOT NULL AND deleted_at < ?
+                                   ORDER BY deleted_at LIMIT ?''', (before, batch_size)).fetchall()
+            if not rows:
+                break
+            for position, count in enumerate(purge_batch(conn, rows, before)):
+                totals[position] += count
+            if len(rows) < batch_size:
+                break
+            time.sleep(pause)
+    finally:
+        if own_conn:
+            conn.close()
+    logger.info('purge: %d students, %d accounts, %d files removed', *totals)
+    return tuple(totals)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dry-run', action='store_true', help='count the students due without removing them')
+    parser.add_argument('--retention-hours', type=float, default=RETENTION / 3600,
+                        help='keep deleted students restorable for this long')
+    args = parser.parse_args()
+
+    for shard in SHARDS:
+        started = time.perf_counter()
+        with use_shard(shard):
+            students, accounts, files = purge_deleted(retention=args.retention_hours * 3600, dry_run=args.dry_run)
+        if args.dry_run:
+            print(f'{shard.name}: {students} students due')
+        else:
+            print(f'{shard.name}: {students} students, {accounts} accounts and {files} files removed '
+                  f'in {time.perf_counter() - started:.1f}s')
+
+if __name__ == '__main__':
+    main()
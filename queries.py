@@ -0,0 +1,88 @@
+"""Projected SELECT statements for the app's tables.
+
+Callers name the fields they need and get back SQL that reads only those
+columns, so listings never pull password hashes or file paths they don't
+show, and a query whose fields all sit in one index (say, course names) can
+be answered from that index without touching the table. Field names are
+checked against each table's whitelist, which keeps them safe to splice into
+SQL; values always go through parameters.
+"""
+
+class Table:
+    def __init__(self, name, fields, joins=None):
+        # fields: name -> SQL expression. joins: table -> JOIN clause, added
+        # only when a requested field comes from that table
+        self.name = name
+        self.fields = fields
+        self.joins = joins or {}
+
+    def columns(self, fields):
+        unknown = [field for field in fields if field not in self.fields]
+        if unknown:
+            raise ValueError(f"Unknown {self.name} fields: {', '.join(unknown)}")
+        return [self.fields[field] if self.fields[field] == f'{self.name}.{field}'
+                else f'{self.fields[field]} AS {field}' for field in fields]
+
+    def select(self, fields, where=None, order_by=None):
+        sql = f"SELECT {', '.join(self.columns(fields))} FROM {self.name}"
+        for table, join in self.joins.items():
+            if any(self.fields[field].startswith(f'{table}.') for field in fields):
+                sql += f' {join}'
+        if where:
+            sql += f' WHERE {where}'
+        if order_by:
+            sql += f' ORDER BY {order_by}'
+        return sql
+
+USERS = Table('users', {
+    'id': 'users.id',
+    'username': 'users.username',
+    'password': 'users.password',
+    'is_admin': 'users.is_admin',
+    'deleted_at': 'users.deleted_at',
+})
+
+STUDENTS = Table('students', {
+    'id': 'students.id',
+    'user_id': 'students.user_id',
+    'name': 'students.name',
+    'email': 'students.email',
+    'course_id': 'students.course_id',
+    'course': 'courses.name',
+    'student_id': 'students.student_id',
+    'register_no': 'students.register_no',
+    'academic_year': 'students.academic_year',
+    'resume_path': 'students.resume_path',
+    'resume_sha256': 'students.resume_sha256',
+    'photo_path': 'students.photo_path',
+    'deleted_at': 'students.deleted_at',
+}, joins={'courses': 'LEFT JOIN courses ON courses.id = students.course_id'})
+
+PENDING_REGISTRATIONS = Table('pending_registrations', {
+    'id': 'pending_registrations.id',
+    'username': 'pending_registrations.username',
+    'password': 'pending_registrations.password',
+    'name': 'pending_registrations.name',
+    'email': 'pending_registrations.email',
+    'course_id': 'pending_registrations.course_id',
+    'course': 'courses.name',
+}, joins={'courses': 'LEFT JOIN courses ON courses.id = pending_registrations.course_id'})
+
+COURSES = Table('courses', {
+    'id': 'courses.id',
+    'name': 'courses.name',
+})
+
+# Deleted students keep their rows until purge.py removes them; every
+# listing leaves them out with this condition, which is also what lets
+# SQLite use the partial indexes on students
+LIVE_STUDENTS = 'students.deleted_at IS NULL'
+
+# Field sets the app asks for most often
+SESSION_USER_FIELDS = ['id', 'username', 'is_admin']
+STUDENT_PROFILE_FIELDS = ['name', 'email', 'course', 'student_id', 'register_no', 'academic_year',
+                          'resume_path', 'resume_sha256', 'photo_path']
+STUDENT_DETAIL_FIELDS = ['id', 'name', 'email', 'course', 'student_id', 'register_no', 'academic_year',
+                         'resume_path', 'photo_path']
+STUDENT_LIST_FIELDS = ['name', 'email', 'course', 'student_id', 'register_no', 'academic_year', 'resume_path']
+PENDING_LISTING_FIELDS = ['id', 'username', 'name', 'email', 'course']
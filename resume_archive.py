@@ -0,0 +1,158 @@
+"""Parallel ZIP archives for bulk resume downloads.
+
+Entries are compressed independently in a process pool and the archive is
+assembled here, writing local headers, data and the central directory with
+the right offsets. Each entry is stored or deflated depending on how well a
+sample of it compresses: most PDFs are already compressed inside, and
+deflating them again only burns CPU. Files that can't be found are left out
+and reported, rather than failing the whole archive.
+"""
+import io
+import multiprocessing
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from upload_gc import normalize
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+# Bytes from the start of a file used to judge compressibility, and the ratio
+# above which an entry is stored as is
+SAMPLE_SIZE = 64 * 1024
+STORE_RATIO = 0.9
+COMPRESS_LEVEL = 6
+# Below this many entries, starting worker processes costs more than it saves
+PARALLEL_MIN_ENTRIES = 16
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+
+def choose_method(data):
+    sample = data[:SAMPLE_SIZE]
+    if not sample:
+        return ZIP_STORED
+    compressed = zlib.compress(sample, 1)
+    return ZIP_STORED if len(compressed) >= len(sample) * STORE_RATIO else ZIP_DEFLATED
+
+def dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    # DOS dates start in 1980
+    year = max(t.tm_year, 1980)
+    date = (year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday
+    clock = t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2
+    return date, clock
+
+def compress_entry(entry):
+    # Runs in a worker process: read, pick a method, compress. None if the
+    # file is gone.
+    source, arcname = entry
+    try:
+        with open(source, 'rb') as f:
+            data = f.read()
+        mtime = os.path.getmtime(source)
+    except FileNotFoundError:
+        return None
+    if len(data) > ZIP64_LIMIT:
+        raise ValueError(f'{source} is too large for an archive entry')
+    method = choose_method(data)
+    if method == ZIP_DEFLATED:
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+        payload = compressor.compress(data) + compressor.flush()
+        # A sample can be misleading; never let an entry grow
+        if len(payload) >= len(data):
+            method, payload = ZIP_STORED, data
+    else:
+        payload = data
+    return arcname, method, zlib.crc32(data), len(data), payload, mtime
+
+class ZipAssembler:
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.offset = 0
+        self.records = []
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def add(self, arcname, method, crc, size, payload, mtime):
+        name = arcname.encode('utf-8')
+        # Bit 11 marks the name as UTF-8
+        flags = 0x800 if not arcname.isascii() else 0
+        date, clock = dos_datetime(mtime)
+        header_offset = self.offset
+        self._write(struct.pack('<4s5H3L2H', b'PK\x03\x04', 20, flags, method, clock, date,
+                                crc, len(payload), size, len(name), 0))
+        self._write(name)
+        self._write(payload)
+        self.records.append((name, flags, method, clock, date, crc, len(payload), size, header_offset))
+
+    def finish(self):
+        directory_offset = self.offset
+        for name, flags, method, clock, date, crc, compressed, size, header_offset in self.records:
+            extra = b''
+            if header_offset > ZIP64_LIMIT:
+                # Only the header offset can overflow; entries are capped at 4 GiB
+                extra = struct.pack('<2HQ', 0x0001, 8, header_offset)
+                header_offset = ZIP64_LIMIT
+            version = 45 if extra else 20
+            # Made by: Unix (3), so the external attributes carry file permissions
+            self._write(struct.pack('<4s6H3L5H2L', b'PK\x01\x02', 0x0300 | version, version, flags, method, clock, date,
+                                    crc, compressed, size, len(name), len(extra), 0, 0, 0, 0o100644 << 16,
+                                    header_offset))
+            self._write(name)
+            self._write(extra)
+        directory_size = self.offset - directory_offset
+        count = len(self.records)
+
+        if count > ZIP_FILECOUNT_LIMIT or directory_offset > ZIP64_LIMIT or directory_size > ZIP64_LIMIT:
+            zip64_end = self.offset
+            self._write(struct.pack('<4sQ2H2L4Q', b'PK\x06\x06', 44, 45, 45, 0, 0,
+                                    count, count, directory_size, directory_offset))
+            self._write(struct.pack('<4sLQL', b'PK\x06\x07', 0, zip64_end, 1))
+            count = min(count, ZIP_FILECOUNT_LIMIT)
+            directory_size = min(directory_size, ZIP64_LIMIT)
+            directory_offset = min(directory_offset, ZIP64_LIMIT)
+        self._write(struct.pack('<4s4H2LH', b'PK\x05\x06', 0, 0, count, count,
+                                directory_size, directory_offset, 0))
+
+_executor = None
+
+def get_executor():
+    # One pool per process, started on first use and reused afterwards.
+    # spawn behaves the same on every platform and is safe from threaded
+    # servers such as Streamlit.
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+def write_zip(entries, fileobj, parallel=None, missing=None):
+    # entries: (source path, name inside the archive) pairs, as stored on
+    # students. Sources that don't exist are appended to missing, if given.
+    entries = [(normalize(source), arcname) for source, arcname in entries]
+    if parallel is None:
+        parallel = len(entries) >= PARALLEL_MIN_ENTRIES
+    if parallel:
+        results = get_executor().map(compress_entry, entries, chunksize=8)
+    else:
+        results = map(compress_entry, entries)
+    assembler = ZipAssembler(fileobj)
+    for (source, _), result in zip(entries, results):
+        if result is None:
+            if missing is not None:
+                missing.append(source)
+            continue
+        assembler.add(*result)
+    assembler.finish()
+    return len(assembler.records)
+
+def build_zip(entries, parallel=None, missing=None):
+    buffer = io.BytesIO()
+    write_zip(entries, buffer, parallel, missing)
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,198 @@
+"""Resume books: one merged PDF per course or academic year.
+
+Each book starts with a cover page and an index of students with the page
+their resume starts on, followed by every member's resume, with a bookmark
+per student. Books are cached like resume bundles and keyed the same way,
+plus the register numbers the index prints, so a book is only rebuilt when a
+member's resume or index entry changes. Books are built in worker processes:
+the PDF writer keeps every page until it writes the file, which the app's
+server process shouldn't have to hold.
+
+    python resume_books.py                  # every course, on every campus
+    python resume_books.py MCA MBA
+    python resume_books.py --by academic_year --shard rmp
+"""
+import argparse
+import io
+import math
+import os
+import tempfile
+import threading
+import time
+from datetime import date
+
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.errors import PdfReadError
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from db import unit_of_work
+from resume_archive import get_executor
+from resume_bundles import GROUPS, bundle_members, bundle_key, evict_lru
+from shards import SHARDS, get_shard, init_shards, use_shard
+
+BOOK_DIR = 'book_cache'
+BOOK_CACHE_BYTES = 2 * 1024 ** 3
+INDEX_ROWS_PER_PAGE = 40
+# Member fields printed in the index besides the name
+INDEX_FIELDS = ('register_no',)
+
+def count_pages(path):
+    # Unreadable or missing resumes are left out of the book and marked as
+    # unavailable in the index
+    try:
+        return len(PdfReader(path).pages)
+    except (OSError, PdfReadError):
+        return 0
+
+def render_front_matter(title, entries, index_pages):
+    # entries: (name, register number, first page or None)
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+
+    pdf.setFont('Helvetica-Bold', 28)
+    pdf.drawCentredString(width / 2, height * 0.6, title)
+    pdf.setFont('Helvetica', 14)
+    pdf.drawCentredString(width / 2, height * 0.6 - 40, f'{len(entries)} students')
+    pdf.drawCentredString(width / 2, height * 0.6 - 60, date.today().strftime('%d %B %Y'))
+    pdf.showPage()
+
+    for page in range(index_pages):
+        pdf.setFont('Helvetica-Bold', 16)
+        pdf.drawString(60, height - 60, 'Index')
+        pdf.setFont('Helvetica', 10)
+        rows = entries[page * INDEX_ROWS_PER_PAGE:(page + 1) * INDEX_ROWS_PER_PAGE]
+        for row, (name, register_no, first_page) in enumerate(rows):
+            y = height - 90 - row * 17
+            pdf.drawString(60, y, name or 'Unknown')
+            pdf.drawString(330, y, register_no or '')
+            pdf.drawRightString(width - 60, y, str(first_page) if first_page else 'unavailable')
+        pdf.showPage()
+
+    pdf.save()
+    buffer.seek(0)
+    return buffer
+
+def build_book(title, members, output_path):
+    # Runs in a worker process. Resumes are appended one at a time and the
+    # book is written straight to output_path, but the writer holds every
+    # page until then.
+    counts = [count_pages(member['resume_path']) for member in members]
+    index_pages = max(1, math.ceil(len(members) / INDEX_ROWS_PER_PAGE))
+    next_page = 1 + index_pages + 1
+    entries = []
+    for member, count in zip(members, counts):
+        entries.append((member['name'], member['register_no'], next_page if count else None))
+        next_page += count
+
+    writer = PdfWriter()
+    writer.append(render_front_matter(title, entries, index_pages), import_outline=False)
+    for member, count in zip(members, counts):
+        if count:
+            writer.append(member['resume_path'], outline_item=member['name'] or 'Unknown', import_outline=False)
+    with open(output_path, 'wb') as f:
+        writer.write(f)
+    return len(writer.pages)
+
+class ResumeBookCache:
+    def __init__(self, root=BOOK_DIR, max_bytes=BOOK_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.root, f'{key}.pdf')
+
+    def _plan(self, group, value):
+        # Members and cached path of a book; the path exists if it is current
+        members = bundle_members(group, value, fields=list(INDEX_FIELDS))
+        if not members:
+            return members, None
+        return members, self.path_for(bundle_key(group, value, members, kind='book', fields=INDEX_FIELDS))
+
+    def _temp_path(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.part')
+        os.close(fd)
+        return tmp_path
+
+    def _publish(self, tmp_path, path):
+        # Renamed into place so concurrent readers never see a partial book
+        os.replace(tmp_path, path)
+        with self._lock:
+            evict_lru(self.root, self.max_bytes, '.pdf')
+
+    def get(self, group, value):
+        members, path = self._plan(group, value)
+        if path is None:
+            return None
+        if os.path.exists(path):
+            os.utime(path)
+            return path
+        tmp_path = self._temp_path()
+        try:
+            get_executor().submit(build_book, f'{value} Resumes', members, tmp_path).result()
+            self._publish(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path
+
+    def build_many(self, group, values):
+        # One worker task per book; books already current are not rebuilt.
+        # Returns {value: path}, with None for groups without resumes.
+        results = {}
+        pending = {}
+        for value in values:
+            members, path = self._plan(group, value)
+            results[value] = path
+            if path is None:
+                continue
+            if os.path.exists(path):
+                os.utime(path)
+                continue
+            tmp_path = self._temp_path()
+            future = get_executor().submit(build_book, f'{value} Resumes', members, tmp_path)
+            pending[future] = (tmp_path, path)
+        for future, (tmp_path, path) in pending.items():
+            try:
+                future.result()
+                self._publish(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('values', nargs='*', help='courses (or academic years) to build; default: all')
+    parser.add_argument('--by', choices=list(GROUPS), default='course')
+    parser.add_argument('--shard', help='only this campus (default: every campus)')
+    args = parser.parse_args()
+    try:
+        shards = [get_shard(args.shard)] if args.shard else SHARDS
+    except KeyError as e:
+        parser.error(str(e))
+
+    init_shards()
+    cache = ResumeBookCache()
+    for shard in shards:
+        started = time.perf_counter()
+        with use_shard(shard):
+            values = args.values
+            if not values:
+                with unit_of_work() as uow:
+                    if args.by == 'course':
+                        values = [row['name'] for row in uow.query('SELECT name FROM courses ORDER BY name')]
+                    else:
+                        values = [row['academic_year'] for row in uow.query(
+                            'SELECT DISTINCT academic_year FROM students WHERE academic_year IS NOT NULL '
+                            'AND deleted_at IS NULL ORDER BY academic_year')]
+            results = cache.build_many(args.by, values)
+        for value, path in results.items():
+            print(f'{shard.name} {value:<24} {path or "no resumes"}')
+        print(f'{shard.name}: {len(results)} books in {time.perf_counter() - started:.1f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Prebuilt resume bundles per course or academic year, cached on disk.
+
+A bundle is named after a digest of its members: each member's archive name
+and the SHA-256 of their resume. The hashes are stored with the student when
+the resume is uploaded, so working out whether a bundle is still current is
+one query, and a repeat download is served straight from the cached file.
+A bundle only changes when someone in the group uploads a new resume,
+changes course or academic year, or is added or removed.
+"""
+import functools
+import hashlib
+import os
+import tempfile
+import threading
+
+from db import unit_of_work
+from queries import STUDENTS, LIVE_STUDENTS
+from resume_archive import write_zip
+from write_queue import get_write_queue
+
+BUNDLE_DIR = 'bundle_cache'
+# Least recently used bundles are removed once the cache grows past this
+BUNDLE_CACHE_BYTES = 2 * 1024 ** 3
+
+GROUPS = {
+    'course': 'students.course_id = (SELECT id FROM courses WHERE name = ?)',
+    'academic_year': 'students.academic_year = ?',
+}
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def archive_name(student):
+    # Same naming as the Student List's Download All Resumes
+    return f"{student['name'] or 'Unknown'}_{student['course'] or 'no_course'}_resume.pdf"
+
+def bundle_members(group, value, fields=()):
+    # Students in the group that have a resume, as dicts with their
+    # archive_name and resume_sha256, plus any extra fields requested
+    with unit_of_work() as uow:
+        rows = uow.query(STUDENTS.select(['id', 'name', 'course', 'resume_path', 'resume_sha256', *fields],
+                                         where=f"{GROUPS[group]} AND {LIVE_STUDENTS} AND students.resume_path <> ''",
+                                         order_by='students.id'),
+                         (value,))
+    members, hashed = [], []
+    for row in rows:
+        member = dict(row)
+        if not member['resume_sha256']:
+            # Uploaded before hashes were recorded; hash once and keep it
+            if not os.path.exists(member['resume_path']):
+                continue
+            member['resume_sha256'] = file_sha256(member['resume_path'])
+            hashed.append((member['resume_sha256'], member['id'], member['resume_path']))
+        member['archive_name'] = archive_name(member)
+        members.append(member)
+    if hashed:
+        # Saved by the writer thread in its own short transaction: the
+        # caller's unit of work is a read snapshot and must stay one, or it
+        # would hold the write lock for the rest of the build. Nothing waits
+        # on it; if it fails, the next build hashes again. A resume replaced
+        # in the meantime keeps the hash its upload recorded.
+        get_write_queue().submit(functools.partial(save_hashes, hashed))
+    return members
+
+def save_hashes(hashed, conn):
+    for params in hashed:
+        conn.execute('UPDATE students SET resume_sha256 = ? WHERE id = ? AND resume_path = ? AND resume_sha256 IS NULL',
+                     params)
+
+def bundle_key(group, value, members, kind='zip', fields=()):
+    # fields: further member fields the output shows, such as the register
+    # numbers printed in a book's index
+    digest = hashlib.sha256(f'{kind}\0{group}\0{value}\n'.encode())
+    for member in sorted(members, key=lambda member: member['archive_name']):
+        shown = ''.join(f'\0{member[field]}' for field in fields)
+        digest.update(f"{member['archive_name']}\0{member['resume_sha256']}{shown}\n".encode())
+    return digest.hexdigest()
+
+def evict_lru(root, max_bytes, suffix):
+    # Remove the least recently used files (by mtime) until the cache fits
+    entries = []
+    for entry in os.scandir(root):
+        if entry.name.endswith(suffix):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+class ResumeBundleCache:
+    def __init__(self, root=BUNDLE_DIR, max_bytes=BUNDLE_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.root, f'{key}.zip')
+
+    def get(self, group, value):
+        # Returns the path of an up to date bundle, building it if needed,
+        # or None when nobody in the group has a resume
+        members = bundle_members(group, value)
+        if not members:
+            return None
+        path = self.path_for(bundle_key(group, value, members))
+        if os.path.exists(path):
+            # mtime doubles as the last-used time for eviction
+            os.utime(path)
+            return path
+
+        # Build next to the final name and rename, so a concurrent request
+        # never sees a half-written bundle
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write_zip([(member['resume_path'], member['archive_name']) for member in members], f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+        return path
+
+    def evict(self):
+        with self._lock:
+            evict_lru(self.root, self.max_bytes, '.zip')
@@ -0,0 +1,270 @@
+import logging
+
+from db import get_db_connection, is_postgres
+
+logger = logging.getLogger(__name__)
+
+def create_tables(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS users
+                 (id INTEGER PRIMARY KEY, username TEXT UNIQUE, password TEXT, is_admin INTEGER)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS students
+                 (id INTEGER PRIMARY KEY, user_id INTEGER, name TEXT, email TEXT, course TEXT,
+                 FOREIGN KEY (user_id) REFERENCES users(id))''')
+
+    # Check if columns exist, if not, add them
+    c.execute("PRAGMA table_info(students)")
+    columns = [column[1] for column in c.fetchall()]
+    new_columns = ['resume_path', 'photo_path', 'student_id', 'register_no', 'academic_year']
+    for col in new_columns:
+        if col not in columns:
+            c.execute(f'ALTER TABLE students ADD COLUMN {col} TEXT')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS pending_registrations
+                 (id INTEGER PRIMARY KEY, username TEXT UNIQUE, password TEXT, name TEXT, email TEXT, course TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS courses
+                 (id INTEGER PRIMARY KEY, name TEXT UNIQUE)''')
+
+# Migrations
+#
+# Each migration runs once, in order, inside the same transaction as the bump
+# of PRAGMA user_version to its position in MIGRATIONS.
+
+def migrate_course_ids(c):
+    # Course names used to be copied into students and pending_registrations
+    # as free text. Replace them with a course_id foreign key; names that no
+    # longer exist in courses are added back so no enrolment is lost.
+    for table in ('students', 'pending_registrations'):
+        c.execute(f'''INSERT OR IGNORE INTO courses (name)
+                      SELECT DISTINCT course FROM {table} WHERE course <> '' AND course IS NOT NULL''')
+
+    c.execute('''CREATE TABLE students_new
+                 (id INTEGER PRIMARY KEY, user_id INTEGER, name TEXT, email TEXT,
+                 course_id INTEGER REFERENCES courses(id) ON UPDATE CASCADE ON DELETE SET NULL,
+                 resume_path TEXT, photo_path TEXT, student_id TEXT, register_no TEXT, academic_year TEXT,
+                 FOREIGN KEY (user_id) REFERENCES users(id))''')
+    c.execute('''INSERT INTO students_new (id, user_id, name, email, course_id, resume_path, photo_path,
+                 student_id, register_no, academic_year)
+                 SELECT id, user_id, name, email, (SELECT id FROM courses WHERE name = students.course),
+                 resume_path, photo_path, student_id, register_no, academic_year FROM students''')
+    c.execute('DROP TABLE students')
+    c.execute('ALTER TABLE students_new RENAME TO students')
+
+    c.execute('''CREATE TABLE pending_registrations_new
+                 (id INTEGER PRIMARY KEY, username TEXT UNIQUE, password TEXT, name TEXT, email TEXT,
+                 course_id INTEGER REFERENCES courses(id) ON UPDATE CASCADE ON DELETE SET NULL)''')
+    c.execute('''INSERT INTO pending_registrations_new (id, username, password, name, email, course_id)
+                 SELECT id, username, password, name, email,
+                 (SELECT id FROM courses WHERE name = pending_registrations.course) FROM pending_registrations''')
+    c.execute('DROP TABLE pending_registrations')
+    c.execute('ALTER TABLE pending_registrations_new RENAME TO pending_registrations')
+
+    c.execute('CREATE INDEX IF NOT EXISTS idx_students_course_id ON students(course_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_pending_registrations_course_id ON pending_registrations(course_id)')
+
+def add_lookup_indexes(c):
+    # student_view looks students up by user_id on every render, and email and
+    # register_no are what admins and registrars match students on
+    # Students that have not filled in their details yet have no register
+    # number; store that as NULL so they don't collide in the unique index
+    c.execute("UPDATE students SET register_no = NULL WHERE register_no = ''")
+
+    c.execute('CREATE INDEX IF NOT EXISTS idx_students_user_id ON students(user_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_students_email ON students(email)')
+    # Free-text register numbers entered before this may repeat. That must
+    # not stop the portal starting, so the index stays plain until they are
+    # fixed; unique_register_numbers() then makes it unique.
+    unique = '' if duplicate_register_numbers(c) else 'UNIQUE '
+    c.execute(f'CREATE {unique}INDEX IF NOT EXISTS idx_students_register_no ON students(register_no)')
+
+def duplicate_register_numbers(c):
+    return [row[0] for row in c.execute('''SELECT register_no FROM students WHERE register_no IS NOT NULL
+                                           GROUP BY register_no HAVING COUNT(*) > 1''')]
+
+def unique_register_numbers(c):
+    # Runs on every start. Returns whether register numbers are unique,
+    # upgrading the plain index once the duplicates are gone and logging
+    # them while they remain.
+    indexes = {row[1]: row[2] for row in c.execute('PRAGMA index_list(students)')}
+    if indexes.get('idx_students_register_no', 1):
+        return True
+    duplicates = duplicate_register_numbers(c)
+    if duplicates:
+        logger.warning('Register numbers are duplicated, so students are not matched on them until fixed: %s',
+                       ', '.join(duplicates))
+        return False
+    c.execute('BEGIN IMMEDIATE')
+    try:
+        c.execute('DROP INDEX idx_students_register_no')
+        c.execute('CREATE UNIQUE INDEX idx_students_register_no ON students(register_no)')
+        c.execute('COMMIT')
+    except Exception:
+        c.execute('ROLLBACK')
+        raise
+    return True
+
+def add_resume_hashes(c):
+    # Content hash of each student's resume, recorded at upload time, so
+    # resume bundles can tell whether their members changed without reading
+    # the files. Existing rows are hashed lazily by resume_bundles.py.
+    c.execute('ALTER TABLE students ADD COLUMN resume_sha256 TEXT')
+
+CHANGE_TRACKED_TABLES = ('students', 'pending_registrations')
+
+def add_change_tracking(c):
+    # Every insert, update and delete on the tracked tables is recorded in
+    # change_log, so open views can fetch just the rows that changed since
+    # the last version they saw (see change_tracking.py). AUTOINCREMENT keeps
+    # versions from being reused once old entries are pruned, and
+    # sqlite_sequence remembers the latest one even when the log is empty.
+    c.execute('''CREATE TABLE change_log
+                 (version INTEGER PRIMARY KEY AUTOINCREMENT, table_name TEXT NOT NULL, row_id INTEGER NOT NULL,
+                 operation TEXT NOT NULL, changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')))''')
+    for table in CHANGE_TRACKED_TABLES:
+        # ADD COLUMN can't take a CURRENT_TIMESTAMP default, so the triggers
+        # fill updated_at in
+        c.execute(f'ALTER TABLE {table} ADD COLUMN updated_at TEXT')
+        c.execute(f"UPDATE {table} SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')")
+        # The stamping UPDATE inside the insert trigger changes updated_at, so
+        # the WHEN clause keeps it from being logged a second time as an update
+        c.execute(f'''CREATE TRIGGER {table}_inserted AFTER INSERT ON {table} BEGIN
+                      UPDATE {table} SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+                      INSERT INTO change_log (table_name, row_id, operation) VALUES ('{table}', NEW.id, 'insert');
+                      END''')
+        c.execute(f'''CREATE TRIGGER {table}_updated AFTER UPDATE ON {table}
+                      WHEN NEW.updated_at IS OLD.updated_at BEGIN
+                      UPDATE {table} SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+                      INSERT INTO change_log (table_name, row_id, operation) VALUES ('{table}', NEW.id, 'update');
+                      END''')
+        c.execute(f'''CREATE TRIGGER {table}_deleted AFTER DELETE ON {table} BEGIN
+                      INSERT INTO change_log (table_name, row_id, operation) VALUES ('{table}', OLD.id, 'delete');
+                      END''')
+        # Renaming a course changes what every row on it shows
+        c.execute(f'''CREATE TRIGGER {table}_course_renamed AFTER UPDATE OF name ON courses BEGIN
+                      INSERT INTO change_log (table_name, row_id, operation)
+                      SELECT '{table}', id, 'update' FROM {table} WHERE course_id = NEW.id;
+                      END''')
+
+def add_name_search(c):
+    # Trigram index over student names for fuzzy search (see trigram.py).
+    # It stores only the index and reads names from students, which the
+    # triggers keep it in step with.
+    c.execute('''CREATE VIRTUAL TABLE student_names USING fts5
+                 (name, content='students', content_rowid='id', tokenize='trigram')''')
+    c.execute('''CREATE TRIGGER student_names_inserted AFTER INSERT ON students BEGIN
+                 INSERT INTO student_names (rowid, name) VALUES (NEW.id, NEW.name);
+                 END''')
+    c.execute('''CREATE TRIGGER student_names_deleted AFTER DELETE ON students BEGIN
+                 INSERT INTO student_names (student_names, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+                 END''')
+    c.execute('''CREATE TRIGGER student_names_updated AFTER UPDATE OF name ON students BEGIN
+                 INSERT INTO student_names (student_names, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+                 INSERT INTO student_names (rowid, name) VALUES (NEW.id, NEW.name);
+                 END''')
+    c.execute("INSERT INTO student_names (student_names) VALUES ('rebuild')")
+
+def add_soft_delete(c):
+    # Deleting a student stamps deleted_at on the student and their account
+    # and purge.py removes both later (see data.delete_students). Listings
+    # only read live rows, so the indexes they use leave deleted rows out;
+    # students.user_id keeps a full index, which foreign key checks and the
+    # purge need. The purge finds its work through the small partial index
+    # on deleted_at.
+    for table in ('users', 'students'):
+        c.execute(f'ALTER TABLE {table} ADD COLUMN deleted_at TEXT')
+    c.execute('DROP INDEX IF EXISTS idx_students_course_id')
+    c.execute('DROP INDEX IF EXISTS idx_students_email')
+    c.execute('CREATE INDEX idx_students_live_course_id ON students(course_id) WHERE deleted_at IS NULL')
+    c.execute('CREATE INDEX idx_students_live_email ON students(email) WHERE deleted_at IS NULL')
+    c.execute('CREATE INDEX idx_students_deleted_at ON students(deleted_at) WHERE deleted_at IS NOT NULL')
+
+MIGRATIONS = [
+    migrate_course_ids,
+    add_lookup_indexes,
+    add_resume_hashes,
+    add_change_tracking,
+    add_name_search,
+    add_soft_delete,
+]
+
+# PostgreSQL
+#
+# A PostgreSQL database starts out in the shape the SQLite migrations above
+# arrive at. Every statement is idempotent, so this runs on each start; later
+# schema changes are appended as further IF NOT EXISTS statements.
+POSTGRES_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS users
+       (id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, username TEXT UNIQUE, password TEXT, is_admin INTEGER)''',
+    '''CREATE TABLE IF NOT EXISTS courses
+       (id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, name TEXT UNIQUE)''',
+    '''CREATE TABLE IF NOT EXISTS students
+       (id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, user_id INTEGER REFERENCES users(id), name TEXT, email TEXT,
+       course_id INTEGER REFERENCES courses(id) ON UPDATE CASCADE ON DELETE SET NULL,
+       resume_path TEXT, photo_path TEXT, student_id TEXT, register_no TEXT UNIQUE, academic_year TEXT,
+       resume_sha256 TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS pending_registrations
+       (id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, username TEXT UNIQUE, password TEXT, name TEXT, email TEXT,
+       course_id INTEGER REFERENCES courses(id) ON UPDATE CASCADE ON DELETE SET NULL)''',
+    'CREATE INDEX IF NOT EXISTS idx_students_user_id ON students (user_id)',
+    'CREATE INDEX IF NOT EXISTS idx_pending_registrations_course_id ON pending_registrations (course_id)',
+    # Soft delete (see add_soft_delete)
+    'ALTER TABLE users ADD COLUMN IF NOT EXISTS deleted_at TEXT',
+    'ALTER TABLE students ADD COLUMN IF NOT EXISTS deleted_at TEXT',
+    'DROP INDEX IF EXISTS idx_students_course_id',
+    'DROP INDEX IF EXISTS idx_students_email',
+    'CREATE INDEX IF NOT EXISTS idx_students_live_course_id ON students (course_id) WHERE deleted_at IS NULL',
+    'CREATE INDEX IF NOT EXISTS idx_students_live_email ON students (email) WHERE deleted_at IS NULL',
+    'CREATE INDEX IF NOT EXISTS idx_students_deleted_at ON students (deleted_at) WHERE deleted_at IS NOT NULL',
+    # Searches fold case with this; SQLite connections register it (see db.py)
+    """CREATE OR REPLACE FUNCTION fold_case(value TEXT) RETURNS TEXT
+       LANGUAGE SQL IMMUTABLE AS 'SELECT lower(value)'""",
+]
+
+def init_postgres(conn):
+    conn.execute('BEGIN')
+    try:
+        for statement in POSTGRES_SCHEMA:
+            conn.execute(statement)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+def init_db():
+    conn = get_db_connection()
+    if is_postgres():
+        return init_postgres(conn)
+    # Transactions are managed by hand so each migration commits atomically
+    conn.isolation_level = None
+    c = conn.cursor()
+    # WAL lets the long read transaction of one rerun coexist with writers
+    c.execute('PRAGMA journal_mode=WAL')
+    # Only takes effect on a brand new database; maintenance.py
+    # --enable-incremental-vacuum converts existing ones so deleted rows'
+    # pages can be handed back gradually
+    c.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    # Table rebuilds would trip the foreign keys pointing at them; this pragma
+    # is a no-op inside a transaction, so it has to be switched off up front
+    c.execute('PRAGMA foreign_keys=OFF')
+
+    c.execute('BEGIN')
+    create_tables(c)
+    c.execute('COMMIT')
+
+    version = c.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        c.execute('BEGIN IMMEDIATE')
+        try:
+            migration(c)
+            problems = c.execute('PRAGMA foreign_key_check').fetchall()
+            if problems:
+                raise RuntimeError(f'Migration {migration.__name__} left broken foreign keys: {problems}')
+            c.execute(f'PRAGMA user_version = {number}')
+            c.execute('COMMIT')
+        except Exception:
+            c.execute('ROLLBACK')
+            raise
+
+    unique_register_numbers(c)
+    conn.close()
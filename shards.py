@@ -0,0 +1,117 @@
+"""Route each campus (tenant) to its own database and upload folder.
+
+Each campus gets its own SQLite file and upload root, so no single file
+grows without bound and campuses don't wait on each other's write lock.
+Shards are listed in shards.json (or the file named by SHARDS_CONFIG):
+
+    [
+        {"name": "ktr", "domain": "srmist.edu.in", "db": "students.db", "uploads": "."},
+        {"name": "rmp", "domain": "rmp.srmist.edu.in", "db": "shards/rmp.db", "uploads": "shards/rmp"}
+    ]
+
+Without a config there is one shard: students.db with uploads next to the
+app, exactly as before. Students are routed by their email domain. Admin
+views that span campuses run the same query on every shard in parallel and
+merge the results.
+"""
+import json
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pandas as pd
+
+import db
+from schema import init_db
+
+SHARDS_CONFIG = os.environ.get('SHARDS_CONFIG', 'shards.json')
+FAN_OUT_THREADS = 8
+
+Shard = namedtuple('Shard', ['name', 'domain', 'db_path', 'upload_root'])
+
+def load_shards(path=SHARDS_CONFIG):
+    if not os.path.exists(path):
+        return [Shard('default', 'srmist.edu.in', db.DB_PATH, '.')]
+    with open(path) as f:
+        shards = [Shard(entry['name'], entry['domain'].lower(), entry['db'], entry.get('uploads', '.'))
+                  for entry in json.load(f)]
+    for field in ('name', 'domain', 'db_path', 'upload_root'):
+        values = [os.path.abspath(getattr(shard, field)) if field == 'upload_root' or
+                  (field == 'db_path' and not db.is_postgres(shard.db_path)) else getattr(shard, field)
+                  for shard in shards]
+        # Shared upload roots would let one shard's garbage collection delete
+        # another's files
+        if len(set(values)) != len(values):
+            raise ValueError(f'{path}: every shard needs its own {field}')
+    return shards
+
+SHARDS = load_shards()
+_local = threading.local()
+
+def get_shard(name=None):
+    # The named shard, or the first one
+    if name is None:
+        return SHARDS[0]
+    for shard in SHARDS:
+        if shard.name == name:
+            return shard
+    raise KeyError(f'Unknown shard {name!r}')
+
+def shard_for_email(email):
+    # Shard for the address's domain, or None
+    domain = email.rpartition('@')[2].lower()
+    for shard in SHARDS:
+        if domain == shard.domain:
+            return shard
+    return None
+
+def current_shard():
+    return getattr(_local, 'shard', None) or SHARDS[0]
+
+@contextmanager
+def use_shard(shard):
+    # Connections, units of work and uploads on this thread go to the shard
+    previous = getattr(_local, 'shard', None)
+    _local.shard = shard
+    try:
+        with db.use_database(shard.db_path):
+            yield shard
+    finally:
+        _local.shard = previous
+
+def upload_path(folder):
+    return os.path.normpath(os.path.join(current_shard().upload_root, folder))
+
+# Fan-out
+_executor = ThreadPoolExecutor(FAN_OUT_THREADS, thread_name_prefix='shards')
+
+def _on_shard(shard, func, args, kwargs):
+    with use_shard(shard), db.unit_of_work():
+        return func(*args, **kwargs)
+
+def fan_out(func, *args, shards=None, **kwargs):
+    # Run func on every shard at once; returns [(shard, result)] in shard order
+    shards = shards or SHARDS
+    futures = [(shard, _executor.submit(_on_shard, shard, func, args, kwargs)) for shard in shards]
+    return [(shard, future.result()) for shard, future in futures]
+
+def fan_out_rows(func, *args, **kwargs):
+    # Merged rows, as dicts tagged with their shard's name
+    return [dict(row, shard=shard.name) for shard, rows in fan_out(func, *args, **kwargs) for row in rows]
+
+def fan_out_frame(func, *args, **kwargs):
+    # Merged DataFrames with a leading shard column
+    frames = []
+    for shard, frame in fan_out(func, *args, **kwargs):
+        frames.append(frame.assign(shard=shard.name)[['shard', *frame.columns]])
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def init_shards():
+    # Create or migrate every shard's schema
+    for shard in SHARDS:
+        if not db.is_postgres(shard.db_path):
+            os.makedirs(os.path.dirname(os.path.abspath(shard.db_path)), exist_ok=True)
+        with use_shard(shard):
+            init_db()
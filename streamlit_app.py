@@ -2,168 +2,118 @@ import streamlit as st
 import sqlite3
 import hashlib
 import os
-import zipfile
-import io
-from werkzeug.utils import secure_filename
+import functools
 import re
-import pandas as pd
-
-# Database setup
-def get_db_connection():
-    conn = sqlite3.connect('students.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_db():
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (id INTEGER PRIMARY KEY, username TEXT UNIQUE, password TEXT, is_admin INTEGER)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS students
-                 (id INTEGER PRIMARY KEY, user_id INTEGER, name TEXT, email TEXT, course TEXT,
-                 FOREIGN KEY (user_id) REFERENCES users(id))''')
-    
-    # Check if columns exist, if not, add them
-    c.execute("PRAGMA table_info(students)")
-    columns = [column[1] for column in c.fetchall()]
-    new_columns = ['resume_path', 'photo_path', 'student_id', 'register_no', 'academic_year']
-    for col in new_columns:
-        if col not in columns:
-            c.execute(f'ALTER TABLE students ADD COLUMN {col} TEXT')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS pending_registrations
-                 (id INTEGER PRIMARY KEY, username TEXT UNIQUE, password TEXT, name TEXT, email TEXT, course TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS courses
-                 (id INTEGER PRIMARY KEY, name TEXT UNIQUE)''')
-    conn.commit()
-    conn.close()
-
-# Call init_db() to ensure all necessary columns are added
-init_db()
-
-# Helper functions
-def hash_password(password):
-    return hashlib.sha256(str.encode(password)).hexdigest()
-
-def check_user(username, password):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT * FROM users WHERE username=? AND password=?', (username, hash_password(password)))
-    user = c.fetchone()
-    conn.close()
-    return user
-
-def is_admin(user_id):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT is_admin FROM users WHERE id=?', (user_id,))
-    result = c.fetchone()
-    conn.close()
-    return result['is_admin'] if result else False
-
-def save_file(file, folder):
-    if not os.path.exists(folder):
-        os.makedirs(folder)
-    file_path = os.path.join(folder, secure_filename(file.name))
-    with open(file_path, 'wb') as f:
-        f.write(file.getbuffer())
-    return file_path
-
-def get_all_courses():
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT name FROM courses')
-    courses = [row['name'] for row in c.fetchall()]
-    conn.close()
-    return courses
-
-def search_students(search_query='', course_filter=None):
-    conn = get_db_connection()
-    c = conn.cursor()
-    query = '''SELECT * FROM students WHERE 
-               (name LIKE ? OR email LIKE ?)'''
-    params = [f'%{search_query}%', f'%{search_query}%']
-    
-    if course_filter:
-        query += ' AND course = ?'
-        params.append(course_filter)
-    
-    c.execute(query, params)
-    students = c.fetchall()
-    conn.close()
-    return students
-
-def register_student(username, password, name, email, course):
-    if not email.endswith('@srmist.edu.in'):
-        return False, "Please use an email address with the domain srmist.edu.in"
-    
-    conn = get_db_connection()
-    c = conn.cursor()
-    try:
-        c.execute('INSERT INTO pending_registrations (username, password, name, email, course) VALUES (?, ?, ?, ?, ?)',
-                  (username, hash_password(password), name, email, course))
-        conn.commit()
-        return True, "Registration submitted successfully! Please wait for admin approval."
-    except sqlite3.IntegrityError:
-        return False, "Username already exists. Please choose a different username."
-    finally:
-        conn.close()
-
-def get_pending_registrations():
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT * FROM pending_registrations')
-    registrations = c.fetchall()
-    conn.close()
-    return registrations
-
-def approve_registration(registration_id):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT * FROM pending_registrations WHERE id = ?', (registration_id,))
-    registration = c.fetchone()
-    
-    if registration:
-        c.execute('INSERT INTO users (username, password, is_admin) VALUES (?, ?, 0)',
-                  (registration['username'], registration['password']))
-        user_id = c.lastrowid
-        c.execute('INSERT INTO students (user_id, name, email, course) VALUES (?, ?, ?, ?)',
-                  (user_id, registration['name'], registration['email'], registration['course']))
-        c.execute('DELETE FROM pending_registrations WHERE id = ?', (registration_id,))
-        conn.commit()
-    
-    conn.close()
-
-def add_course(course_name):
-    conn = get_db_connection()
-    c = conn.cursor()
-    try:
-        c.execute('INSERT INTO courses (name) VALUES (?)', (course_name,))
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False
-    finally:
-        conn.close()
-
-def delete_course(course_name):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('DELETE FROM courses WHERE name = ?', (course_name,))
-    conn.commit()
-    conn.close()
+from db import is_postgres, unit_of_work
+from maintenance import MaintenanceThread
+from student_directory import StudentDirectory
+from change_tracking import TrackedFrame
+from resume_archive import build_zip
+from resume_bundles import ResumeBundleCache
+from resume_books import ResumeBookCache
+from file_index import get_upload_index
+from upload_gc import normalize
+from queries import PENDING_REGISTRATIONS, PENDING_LISTING_FIELDS, STUDENT_LIST_FIELDS
+from purge import RETENTION
+from facets import merge_facet_counts
+from shards import (SHARDS, get_shard, shard_for_email, use_shard, current_shard, init_shards, fan_out,
+                    fan_out_frame)
+from data import (check_user, get_user, is_admin, save_file, read_file, get_all_courses, get_academic_years,
+                  get_course_counts, search_students, search_students_frame, suggest_students,
+                  get_student_facets, get_student_by_user_id, save_student_details, register_student,
+                  get_pending_registrations, approve_registration, add_course, rename_course, delete_course,
+                  delete_student, delete_students, get_deleted_students, restore_students)
+
+# Create or migrate every shard's schema before anything reads from it, once
+# per server process rather than on every rerun
+@st.cache_resource
+def prepare_shards():
+    init_shards()
+
+prepare_shards()
+
+# One maintenance thread per server process, shared by all sessions
+@st.cache_resource
+def start_maintenance():
+    thread = MaintenanceThread()
+    thread.start()
+    return thread
+
+start_maintenance()
+
+# The Student List searches an in-memory snapshot of the students table
+# instead of querying SQLite on every keystroke; set STUDENT_DIRECTORY=0 to
+# query the database directly
+USE_STUDENT_DIRECTORY = os.environ.get('STUDENT_DIRECTORY', '1') != '0'
+
+@st.cache_resource
+def get_student_directory(db_path):
+    return StudentDirectory(db_path)
+
+# Admin tabs left open rerun on this interval. Their listings come from
+# shared views that check for commits with one pragma and fetch only the
+# rows that changed
+AUTO_REFRESH_SECONDS = int(os.environ.get('AUTO_REFRESH_SECONDS', '15'))
+
+@st.cache_resource
+def get_pending_view(db_path):
+    return TrackedFrame(db_path, 'pending_registrations',
+                        lambda where: PENDING_REGISTRATIONS.select(PENDING_LISTING_FIELDS, where=where,
+                                                                   order_by='pending_registrations.id'))
+
+@st.cache_resource
+def get_bundle_cache():
+    return ResumeBundleCache()
+
+@st.cache_resource
+def get_book_cache():
+    return ResumeBookCache()
 
 # Streamlit app
+def session_shard():
+    # The campus the signed-in user belongs to; the first one before sign-in
+    return get_shard(st.session_state.get('shard'))
+
+def find_user(username, password):
+    # Usernames are unique per campus, so ask every campus at once
+    for shard, user in fan_out(check_user, username, password):
+        if user:
+            return shard, user
+    return None, None
+
+def data_fragment(func=None, run_every=None):
+    # Fragment reruns skip main(), so each fragment opens its own unit of work;
+    # during a full rerun it simply joins the one opened by main()
+    if func is None:
+        return functools.partial(data_fragment, run_every=run_every)
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with use_shard(session_shard()), unit_of_work():
+            return func(*args, **kwargs)
+    return st.fragment(wrapper, run_every=run_every)
+
 st.logo("assets/srmist.jpg")
 
 def main():
     st.set_page_config(page_title = "Student Portal", layout="wide")
     st.title('Student Management Portal')
 
+    # One read transaction and query cache for the whole rerun, on the
+    # signed-in user's campus
+    with use_shard(session_shard()), unit_of_work():
+        render_page()
+
+def render_page():
     # Initialize session state
     if 'user' not in st.session_state:
         st.session_state.user = None
 
+    # An account deleted while signed in is signed out on its next rerun
+    if st.session_state.user is not None and get_user(st.session_state.user['id']) is None:
+        st.session_state.user = None
+        st.session_state.shard = None
+        st.warning('Your account is no longer active.')
+
     # Check if user is logged in
     if st.session_state.user is None:
         page = st.sidebar.selectbox('Choose an action', ['Login', 'Register'])
@@ -190,9 +140,10 @@ def login():
     password = st.text_input('Password', type='password')
     
     if st.button('Login'):
-        user = check_user(username, password)
+        shard, user = find_user(username, password)
         if user:
             st.session_state.user = user
+            st.session_state.shard = shard.name
             st.rerun()
         else:
             st.error('Invalid username or password')
@@ -204,7 +155,10 @@ def register():
     password = st.text_input('Password', type='password')
     name = st.text_input('Full Name')
     email = st.text_input('Email')
-    course = st.selectbox('Course', get_all_courses())
+    # Courses of the campus the email belongs to, where the registration goes
+    with use_shard(shard_for_email(email) or session_shard()):
+        courses = get_all_courses()
+    course = st.selectbox('Course', courses)
     
     if st.button('Register'):
         if username and password and name and email and course:
@@ -228,15 +182,12 @@ def student_view():
         st.session_state.user_logged_in = False
         st.session_state.user = None
         st.session_state.user_role = None
+        st.session_state.shard = None
         st.rerun()
 
     user_id = st.session_state.user['id']  # Extract user ID from session state directly
 
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT * FROM students WHERE user_id=?', (user_id,))
-    student = c.fetchone()
-    conn.close()
+    student = get_student_by_user_id(user_id)
 
     if student:
         # Convert sqlite3.Row to dictionary if necessary
@@ -269,15 +220,20 @@ def student_view():
             else:
                 st.write("No resume file available.")
 
+    update_details_form(student)
+
+@data_fragment
+def update_details_form(student):
     st.subheader('Update Your Details')
     
     fields = ['name', 'email', 'course', 'student_id', 'register_no', 'academic_year']
     inputs = {}
+    courses = get_all_courses()
 
     for field in fields:
         if field == 'course':
-            inputs[field] = st.selectbox('Course', get_all_courses(), 
-                index=get_all_courses().index(student['course']) if student and 'course' in student.keys() and student['course'] in get_all_courses() else 0)
+            inputs[field] = st.selectbox('Course', courses, 
+                index=courses.index(student['course']) if student and 'course' in student.keys() and student['course'] in courses else 0)
         else:
             inputs[field] = st.text_input(field.capitalize(), value=student[field] if student and field in student.keys() else '')
 
@@ -289,69 +245,146 @@ def student_view():
             resume_path = save_file(resume, 'resumes') if resume else (student['resume_path'] if student and 'resume_path' in student.keys() else None)
             photo_path = save_file(photo, 'photos') if photo else (student['photo_path'] if student and 'photo_path' in student.keys() else None)
             
-            conn = get_db_connection()
-            c = conn.cursor()
-            if student:
-    
-                c.execute('''UPDATE students SET name=?, email=?, course=?, student_id=?, register_no=?, academic_year=?, 
-                            resume_path=?, photo_path=? WHERE user_id=?''', 
-                            (inputs['name'], inputs['email'], inputs['course'], 
-                            inputs['student_id'], inputs['register_no'], inputs['academic_year'],
-                            resume_path, photo_path, st.session_state.user['id']))
+            # Resume bundles tell whether a member changed by this hash
+            resume_sha256 = hashlib.sha256(resume.getbuffer()).hexdigest() if resume else (student['resume_sha256'] if student else None)
+            details = dict(inputs, resume_path=resume_path, resume_sha256=resume_sha256, photo_path=photo_path)
+            success, message = save_student_details(st.session_state.user['id'], details, exists=student is not None)
+            if success:
+                st.success(message)
+                # The dashboard above shows these details, so rerun the whole page
+                st.rerun()
             else:
-                
-                c.execute('''INSERT INTO students (user_id, name, email, course, student_id, register_no, academic_year, 
-                            resume_path, photo_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', 
-                            (st.session_state.user['id'], inputs['name'], inputs['email'], inputs['course'], 
-                            inputs['student_id'], inputs['register_no'], inputs['academic_year'], resume_path, photo_path))
-
-            conn.commit()
-            conn.close()
-            st.success('Details updated successfully!')
-            st.rerun()
+                st.error(message)
         else:
             st.error('Please fill in all fields')
 
-def delete_student(student_id):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('DELETE FROM students WHERE id = ?', (student_id,))
-    conn.commit()
-    conn.close()
-
 def admin_view():
     st.subheader('Admin View')
     
     if st.sidebar.button('Logout'):
         st.session_state.user = None
+        st.session_state.shard = None
         st.rerun()
     
     tab1, tab2, tab3, tab4 = st.tabs(["Student List", "Student Details", "Pending Registrations", "Course Management"])
     
+    # Each tab is a fragment that loads its own data, so interacting with one
+    # tab only reruns that tab instead of the whole admin page
     with tab1:
-        st.subheader('Student List')
-        # Search and Filter Options
-        col1, col2 = st.columns(2)
-        with col1:
-            search_query = st.text_input('Search by name or email', key='search_query_tab1')
-        with col2:
-            courses = ['All'] + get_all_courses()
-            course_filter = st.selectbox('Filter by course', courses, key='course_filter_tab1')
-        
-        if course_filter == 'All':
-            course_filter = None
+        student_list_tab()
+    
+    with tab2:
+        student_details_tab()
+    
+    with tab3:
+        pending_registrations_tab()
+    
+    with tab4:
+        course_management_tab()
+
+FACET_LABELS = {'course': 'Course', 'academic_year': 'Academic year', 'has_resume': 'Resume', 'has_photo': 'Photo'}
+
+def facet_value_label(facet, value):
+    if facet in ('has_resume', 'has_photo'):
+        noun = 'resume' if facet == 'has_resume' else 'photo'
+        return f'With {noun}' if value else f'Without {noun}'
+    return '(none)' if value is None else str(value)
+
+def facet_filters(search_query, all_campuses, include_archived):
+    # One multiselect per facet, each value showing how many students it
+    # would leave; returns {facet: values picked}. The counts are for the
+    # picks as they stood when this rerun started, over the same students
+    # the list shows.
+    selected = {facet: st.session_state.get(f'facet_{facet}', []) for facet in FACET_LABELS}
+    if all_campuses:
+        total, counts = merge_facet_counts(result for _, result in fan_out(get_student_facets, search_query, selected,
+                                                                          include_archived=include_archived))
+    else:
+        total, counts = get_student_facets(search_query, selected, include_archived=include_archived)
+    st.caption(f'{total} students')
+    filters = {}
+    for facet, label in FACET_LABELS.items():
+        facet_counts = dict(counts[facet])
+        # Keep picks offered even when the search leaves none of them
+        options = list(facet_counts) + [value for value in selected[facet] if value not in facet_counts]
+        filters[facet] = st.multiselect(label, options, key=f'facet_{facet}',
+                                        format_func=lambda value, facet=facet, facet_counts=facet_counts:
+                                        f'{facet_value_label(facet, value)} ({facet_counts.get(value, 0)})')
+    return filters
+
+def delete_controls(df, rows, search_query, filters):
+    # rows: positions ticked in the table. Deleting only marks the students,
+    # so the click returns at once; purge.py removes them later. The table
+    # and checkbox keys carry a version that moves on after each delete, so
+    # their state doesn't point at different students afterwards.
+    version = st.session_state.get('delete_version', 0)
+    deleted = None
+    if rows:
+        chosen = df.iloc[rows]
+        names = ', '.join(chosen['name'].fillna('Unknown').astype(str).head(3))
+        if len(chosen) > 3:
+            names += f' and {len(chosen) - 3} more'
+        if st.button(f'Delete {len(chosen)} selected: {names}', key='delete_selected'):
+            deleted = delete_students(chosen['id'].tolist())
+    elif search_query or any(filters.values()):
+        if st.checkbox(f'Delete all {len(df)} students matching this search', key=f'delete_matching_{version}'):
+            if st.button('Delete them', key='delete_matching'):
+                # The students listed, not a fresh search that may match others
+                deleted = delete_students(df['id'].tolist())
+    if deleted is not None:
+        st.session_state.delete_version = version + 1
+        st.success(f'Deleted {deleted} students')
+        st.rerun(scope='fragment')
+
+def use_suggestion(name):
+    # Runs before the rerun, while the search box can still be changed
+    st.session_state.search_query_tab1 = name
+
+@data_fragment(run_every=AUTO_REFRESH_SECONDS)
+def student_list_tab():
+    st.subheader('Student List')
+    search_query = st.text_input('Search by name or email', key='search_query_tab1')
+    # Searching every campus runs the query on all shards at once
+    all_campuses = len(SHARDS) > 1 and st.checkbox('All campuses', key='all_campuses_tab1')
+    # Graduated years live in archive files, opened only when asked for
+    include_archived = st.checkbox('Include archived years', key='include_archived_tab1')
+    # Only this campus's live students can be picked for deletion
+    can_delete = not all_campuses and not include_archived
+
+    facet_column, list_column = st.columns([1, 3])
+    with facet_column:
+        filters = facet_filters(search_query, all_campuses, include_archived)
+
+    with list_column:
         # Fetch and display students
-        students = search_students(search_query, course_filter)
-        
-        if students:
-            # Convert sqlite3.Row objects to dictionaries
-            students = [dict(student) for student in students]
-            
-            # Create a DataFrame for display
-            df = pd.DataFrame(students)
-            
+        if all_campuses:
+            df = fan_out_frame(search_students_frame, search_query, include_archived=include_archived, filters=filters)
+        elif include_archived:
+            df = search_students_frame(search_query, include_archived=True, filters=filters)
+        elif USE_STUDENT_DIRECTORY and not is_postgres():
+            # The directory watches SQLite's data_version for changes
+            df = get_student_directory(current_shard().db_path).search(search_query, filters=filters)
+        else:
+            df = search_students_frame(search_query, fields=['id', *STUDENT_LIST_FIELDS], filters=filters)
+
+        # Names spelt differently from the query ("Pavitra" for "S.Pavithra")
+        if len(search_query.strip()) >= 3:
+            if all_campuses:
+                pairs = sorted((pair for _, shard_pairs in fan_out(suggest_students, search_query)
+                                for pair in shard_pairs), key=lambda pair: pair[0], reverse=True)
+            else:
+                pairs = suggest_students(search_query)
+            shown = set(df['name'].dropna()) if 'name' in df.columns else set()
+            suggestions = list(dict.fromkeys(row['name'] for _, row in pairs if row['name'] not in shown))[:3]
+            if suggestions:
+                st.write('Did you mean:')
+                for column, (position, name) in zip(st.columns(len(suggestions)), enumerate(suggestions)):
+                    with column:
+                        st.button(name, key=f'did_you_mean_{position}', on_click=use_suggestion, args=(name,))
+
+        if not df.empty:
             # Define the desired columns
-            desired_columns = ['name', 'email', 'course', 'student_id', 'register_no', 'academic_year']
+            desired_columns = ['shard', 'name', 'email', 'course', 'student_id', 'register_no', 'academic_year']
             
             # Only select columns that exist in the DataFrame
             existing_columns = [col for col in desired_columns if col in df.columns]
@@ -362,18 +395,25 @@ def admin_view():
             else:
                 # Select only the existing columns
                 df_display = df[existing_columns]
-                st.dataframe(df_display)
+                if can_delete:
+                    # Ticked rows can be deleted together
+                    event = st.dataframe(df_display, on_select='rerun', selection_mode='multi-row',
+                                         key=f"student_table_{st.session_state.get('delete_version', 0)}")
+                    delete_controls(df, event.selection.rows, search_query, filters)
+                else:
+                    st.dataframe(df_display)
             
             # Bulk resume download
             if st.button('Download All Resumes'):
-                zip_buffer = io.BytesIO()
-                with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
-                    for student in students:
-                        if student.get('resume_path'):
-                            file_name = f"{student.get('name', 'Unknown')}_{student.get('course', 'no_course')}_resume.pdf"
-                            zip_file.write(student['resume_path'], file_name)
-                
-                zip_buffer.seek(0)
+                # Missing paths come back as NaN rather than None in a frame
+                with_resume = df[df['resume_path'].fillna('') != '']
+                entries = [(student['resume_path'], f"{student.get('name', 'Unknown')}_{student.get('course', 'no_course')}_resume.pdf")
+                           for student in with_resume.to_dict('records')]
+                # Compressed across worker processes; PDFs that don't shrink are stored
+                missing = []
+                zip_buffer = build_zip(entries, missing=missing)
+                if missing:
+                    st.warning(f'{len(missing)} resumes could not be found and were left out.')
                 st.download_button(
                     label="Download Resumes Zip",
                     data=zip_buffer,
@@ -383,90 +423,176 @@ def admin_view():
         else:
             st.write('No student details found matching the search criteria.')
     
-    with tab2:
-        st.subheader('Student Details')
-        
-        # Fetch students without filters
-        students = search_students()
-        
-        if students:
-            students = [dict(student) for student in students]
-            for student in students:
-                with st.expander(f"{student.get('name', 'Unknown')} - {student.get('email', 'No email')}"):
-                    st.write(f"Course: {student.get('course', 'N/A')}")
-                    st.write(f"Student ID: {student.get('student_id', 'N/A')}")
-                    st.write(f"Register No: {student.get('register_no', 'N/A')}")
-                    st.write(f"Academic Year: {student.get('academic_year', 'N/A')}")
-    
-                    # Display the profile photo
-                    if student.get('photo_path') and os.path.exists(student['photo_path']):
-                        st.image(student['photo_path'], caption='Profile Photo', width=200)
-                    else:
-                        st.write("No profile photo available.")
-                    
-                    # Display the resume download button
-                    if student.get('resume_path') and os.path.exists(student['resume_path']):
-                        with open(student['resume_path'], "rb") as file:
-                            st.download_button(
-                                label=f"Download {student.get('name', 'Unknown')}'s Resume",
-                                data=file,
-                                file_name=f"{student.get('name', 'Unknown')}_resume.pdf",
-                                mime="application/pdf"
-                            )
-                    else:
-                        st.write("No resume file available.")
-                    
-                    # Add a delete button for each student
-                    if st.button(f"Delete {student.get('name', 'Unknown')}", key=f"delete_{student['id']}"):
-                        delete_student(student['id'])
-                        st.success(f"Deleted student {student.get('name', 'Unknown')}")
-                        st.rerun()
+    # Prebuilt resume bundles, rebuilt only when a member's resume or group changes
+    st.subheader('Resume Bundles')
+    col1, col2 = st.columns(2)
+    with col1:
+        bundle_by = st.radio('Bundle by', ['Course', 'Academic Year'], horizontal=True, key='bundle_by')
+    with col2:
+        if bundle_by == 'Course':
+            group, options = 'course', get_all_courses()
         else:
-            st.write('No student details found.')
+            group, options = 'academic_year', get_academic_years()
+        bundle_value = st.selectbox(bundle_by, options, key='bundle_value')
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button('Prepare Bundle') and bundle_value:
+            bundle_path = get_bundle_cache().get(group, bundle_value)
+            if bundle_path:
+                with open(bundle_path, 'rb') as file:
+                    st.download_button(
+                        label=f"Download {bundle_value} Resumes",
+                        data=file,
+                        file_name=f"{bundle_value}_resumes.zip",
+                        mime="application/zip"
+                    )
+            else:
+                st.write(f"No resumes uploaded for {bundle_value}.")
+    with col2:
+        # One merged PDF with a cover and index, for placement teams
+        if st.button('Prepare Resume Book') and bundle_value:
+            book_path = get_book_cache().get(group, bundle_value)
+            if book_path:
+                with open(book_path, 'rb') as file:
+                    st.download_button(
+                        label=f"Download {bundle_value} Resume Book",
+                        data=file,
+                        file_name=f"{bundle_value}_resume_book.pdf",
+                        mime="application/pdf"
+                    )
+            else:
+                st.write(f"No resumes uploaded for {bundle_value}.")
+
+@data_fragment
+def student_details_tab():
+    st.subheader('Student Details')
     
-    with tab3:
-        st.subheader('Pending Registrations')
-        pending_registrations = get_pending_registrations()
-        
-        if pending_registrations:
-            for registration in pending_registrations:
-                st.write(f"Username: {registration['username']}")
-                st.write(f"Name: {registration['name']}")
-                st.write(f"Email: {registration['email']}")
-                st.write(f"Course: {registration['course']}")
-                if st.button(f"Approve {registration['username']}", key=f"approve_{registration['id']}"):
-                    approve_registration(registration['id'])
-                    st.success(f"Approved registration for {registration['username']}")
-                    st.rerun()
-                st.write('---')
-        else:
-            st.write('No pending registrations.')
+    # Fetch students without filters
+    students = search_students()
+    uploads = get_upload_index()
     
-    with tab4:
-        st.subheader('Course Management')
-        
-        # Add new course
-        new_course = st.text_input('Add New Course')
-        if st.button('Add Course'):
-            if new_course:
-                if add_course(new_course):
-                    st.success(f"Course '{new_course}' added successfully.")
-                    st.rerun()
+    if students:
+        students = [dict(student) for student in students]
+        for student in students:
+            with st.expander(f"{student.get('name', 'Unknown')} - {student.get('email', 'No email')}"):
+                st.write(f"Course: {student.get('course', 'N/A')}")
+                st.write(f"Student ID: {student.get('student_id', 'N/A')}")
+                st.write(f"Register No: {student.get('register_no', 'N/A')}")
+                st.write(f"Academic Year: {student.get('academic_year', 'N/A')}")
+
+                # Display the profile photo
+                # Stored paths may use Windows separators; open them the way
+                # the index found them
+                if uploads.exists(student.get('photo_path')):
+                    st.image(normalize(student['photo_path']), caption='Profile Photo', width=200)
+                else:
+                    st.write("No profile photo available.")
+                
+                # Display the resume download button
+                if uploads.exists(student.get('resume_path')):
+                    # Read only when clicked, not on every rerun
+                    st.download_button(
+                        label=f"Download {student.get('name', 'Unknown')}'s Resume",
+                        data=functools.partial(read_file, normalize(student['resume_path'])),
+                        file_name=f"{student.get('name', 'Unknown')}_resume.pdf",
+                        mime="application/pdf",
+                        key=f"resume_{student['id']}"
+                    )
                 else:
-                    st.error(f"Course '{new_course}' already exists.")
+                    st.write("No resume file available.")
+                
+                # Add a delete button for each student
+                if st.button(f"Delete {student.get('name', 'Unknown')}", key=f"delete_{student['id']}"):
+                    delete_student(student['id'])
+                    st.success(f"Deleted student {student.get('name', 'Unknown')}")
+                    st.rerun(scope='fragment')
+    else:
+        st.write('No student details found.')
+
+    # Deleted students can come back until the purge removes them
+    deleted = {row['id']: row for row in get_deleted_students()}
+    if deleted:
+        with st.expander(f'Recently deleted ({len(deleted)})'):
+            st.caption(f'Students are removed for good, with their accounts and files, '
+                       f'{RETENTION // (24 * 60 * 60)} days after they are deleted.')
+            version = st.session_state.get('restore_version', 0)
+            chosen = st.multiselect('Students to restore', list(deleted), key=f'restore_{version}',
+                                    format_func=lambda student_id: f"{deleted[student_id]['name'] or 'Unknown'} - "
+                                                                   f"{deleted[student_id]['email'] or 'No email'} "
+                                                                   f"(deleted {deleted[student_id]['deleted_at'][:16]})")
+            if st.button('Restore', key='restore_students') and chosen:
+                restored = restore_students(chosen)
+                st.session_state.restore_version = version + 1
+                st.success(f'Restored {restored} students')
+                st.rerun(scope='fragment')
+
+@data_fragment(run_every=AUTO_REFRESH_SECONDS)
+def pending_registrations_tab():
+    st.subheader('Pending Registrations')
+    if is_postgres():
+        pending_registrations = get_pending_registrations()
+    else:
+        frame, _ = get_pending_view(current_shard().db_path).refresh()
+        pending_registrations = frame.to_dict('records')
+    
+    if pending_registrations:
+        for registration in pending_registrations:
+            st.write(f"Username: {registration['username']}")
+            st.write(f"Name: {registration['name']}")
+            st.write(f"Email: {registration['email']}")
+            st.write(f"Course: {registration['course']}")
+            if st.button(f"Approve {registration['username']}", key=f"approve_{registration['id']}"):
+                approve_registration(registration['id'])
+                st.success(f"Approved registration for {registration['username']}")
+                st.rerun(scope='fragment')
+            st.write('---')
+    else:
+        st.write('No pending registrations.')
+
+@data_fragment
+def course_management_tab():
+    st.subheader('Course Management')
+    
+    # Add new course
+    new_course = st.text_input('Add New Course')
+    if st.button('Add Course'):
+        if new_course:
+            if add_course(new_course):
+                st.success(f"Course '{new_course}' added successfully.")
+                # Course lists feed the filters in the other tabs, so rerun the whole page
+                st.rerun()
             else:
-                st.error("Please enter a course name.")
-        
-        # List and delete courses
-        st.subheader('Existing Courses')
-        courses = get_all_courses()
-        for course in courses:
-            col1, col2 = st.columns([3, 1])
-            col1.write(course)
-            if col2.button('Delete', key=f"delete_course_{course}"):
-                delete_course(course)
-                st.success(f"Course '{course}' deleted successfully.")
+                st.error(f"Course '{new_course}' already exists.")
+        else:
+            st.error("Please enter a course name.")
+    
+    # List and delete courses
+    st.subheader('Existing Courses')
+    for row in get_course_counts():
+        course = row['name']
+        col1, col2 = st.columns([3, 1])
+        col1.write(f"{course} ({row['students']} students)")
+        if col2.button('Delete', key=f"delete_course_{course}"):
+            delete_course(course)
+            st.success(f"Course '{course}' deleted successfully.")
+            st.rerun()
+    
+    # Rename a course
+    st.subheader('Rename Course')
+    col1, col2 = st.columns(2)
+    with col1:
+        old_name = st.selectbox('Course to rename', get_all_courses(), key='rename_course_from')
+    with col2:
+        new_name = st.text_input('New course name', key='rename_course_to')
+    if st.button('Rename Course'):
+        if old_name and new_name:
+            if rename_course(old_name, new_name):
+                st.success(f"Course '{old_name}' renamed to '{new_name}'.")
                 st.rerun()
+            else:
+                st.error(f"Course '{new_name}' already exists.")
+        else:
+            st.error("Please enter a new course name.")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,75 @@
+import threading
+
+import numpy as np
+
+import db
+from change_tracking import TrackedFrame
+from queries import STUDENTS, LIVE_STUDENTS, STUDENT_DETAIL_FIELDS
+
+# In-memory student directory
+#
+# Holds a columnar snapshot of the students table so the Student List can be
+# searched and filtered without going back to SQLite on every keystroke.
+# Course names are stored as categorical codes, and lowercased name and email
+# columns are kept alongside for case-insensitive matching.
+#
+# The snapshot is a TrackedFrame: every access checks PRAGMA data_version,
+# which only changes when another connection commits, so an unchanged
+# database costs a single pragma. Changes are merged in row by row from the
+# change log rather than reloading the table; a student deleted since is
+# simply no longer among the rows fetched back.
+class StudentDirectory:
+    def __init__(self, db_path=None):
+        self.students = TrackedFrame(db_path or db.DB_PATH, 'students',
+                                     lambda where: STUDENTS.select(STUDENT_DETAIL_FIELDS,
+                                                                   where=f'{LIVE_STUDENTS} AND {where}' if where
+                                                                   else LIVE_STUDENTS,
+                                                                   order_by='students.id'),
+                                     categories=('course', 'academic_year'),
+                                     strings=('name', 'email', 'student_id', 'register_no'))
+        self._lock = threading.Lock()
+        self.frame = None
+        self._name_lc = None
+        self._email_lc = None
+
+    def refresh(self):
+        with self._lock:
+            frame, changed = self.students.refresh()
+            if changed or self.frame is None:
+                # Arrow-backed strings make the substring search a vectorized kernel
+                self._name_lc = frame['name'].str.lower().fillna('')
+                self._email_lc = frame['email'].str.lower().fillna('')
+                self.frame = frame
+            return self.frame, self._name_lc, self._email_lc
+
+    def search(self, search_query='', course_filter=None, filters=None):
+        # Same semantics as search_students(): substring match on name or email
+        # lowercased by str.lower() (db.fold_case in SQL), an exact course
+        # match and any facet values picked
+        frame, name_lc, email_lc = self.refresh()
+        mask = np.ones(len(frame), dtype=bool)
+        for facet, values in (filters or {}).items():
+            if values:
+                mask &= self._facet_values(frame, facet).isin(values).to_numpy(dtype=bool)
+        if search_query:
+            needle = search_query.lower()
+            mask &= (name_lc.str.contains(needle, regex=False) |
+                     email_lc.str.contains(needle, regex=False)).to_numpy(dtype=bool)
+        if course_filter:
+            categories = frame['course'].cat.categories
+            if course_filter not in categories:
+                return frame.iloc[0:0]
+            mask &= frame['course'].cat.codes.to_numpy() == categories.get_loc(course_filter)
+        return frame[mask]
+
+    @staticmethod
+    def _facet_values(frame, facet):
+        # Each facet's values as facets.FACETS computes them in SQL; missing
+        # values become None so they match a None pick
+        if facet in ('has_resume', 'has_photo'):
+            column = 'resume_path' if facet == 'has_resume' else 'photo_path'
+            return (frame[column].fillna('') != '').astype(int)
+        return frame[facet].astype(object).where(frame[facet].notna(), None)
+
+    def close(self):
+        self.students.close()
@@ -0,0 +1,43 @@
+"""Trigram similarity for matching misspelled names.
+
+Names are split into words, each padded the way PostgreSQL's pg_trgm does
+(two spaces before, one after) so word starts and ends count, and cut into
+overlapping three-letter pieces. Two names are similar in proportion to the
+pieces they share: "Pavitra" and "S.Pavithra" share 6 of 11.
+
+Candidates come from the FTS5 trigram index on student names (see
+schema.add_name_search); only they are scored here, never the whole table.
+"""
+import re
+
+# Below this similarity a name isn't worth suggesting; pg_trgm's default
+SIMILARITY_THRESHOLD = 0.3
+
+_WORDS = re.compile(r'[^\W_]+')
+
+def trigrams(text):
+    grams = set()
+    for word in _WORDS.findall((text or '').lower()):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def similarity(query, name):
+    # The best of the whole name and each of its words, so a first name
+    # typed alone still matches a full name with initials
+    query_grams = trigrams(query)
+    if not query_grams:
+        return 0.0
+    best = 0.0
+    for part in [name, *_WORDS.findall(name or '')]:
+        grams = trigrams(part)
+        if grams:
+            best = max(best, len(query_grams & grams) / len(query_grams | grams))
+    return best
+
+def match_expression(query):
+    # FTS5 query matching any row sharing at least one trigram with query.
+    # The index's tokenizer cuts the raw text, without padding.
+    text = ' '.join(_WORDS.findall(query.lower()))
+    grams = sorted({text[i:i + 3] for i in range(len(text) - 2)})
+    return ' OR '.join('"' + gram.replace('"', '""') + '"' for gram in grams)
@@ -0,0 +1,110 @@
+"""Remove uploaded resumes and photos that no student refers to any more.
+
+Deleting a student or uploading a new resume or photo leaves the old file
+behind. Collection is mark and sweep: one streaming query marks every path
+still referenced, then the upload folders are swept for files that are
+neither marked nor younger than the grace period. The grace period covers
+uploads whose file is on disk but whose row is not committed yet.
+
+    python upload_gc.py --dry-run
+    python upload_gc.py --grace-hours 72
+"""
+import argparse
+import logging
+import os
+import time
+
+from db import get_db_connection
+from shards import SHARDS, upload_path, use_shard
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIRS = ('resumes', 'photos')
+GRACE_PERIOD = 24 * 60 * 60
+# Files removed per batch, and the pause between batches so a large sweep
+# doesn't hog the disk
+SWEEP_BATCH = 500
+SWEEP_PAUSE = 0.05
+
+def normalize(path):
+    # The one key for an upload's path, shared with file_index. Rows written
+    # on Windows use backslashes.
+    return os.path.normcase(os.path.abspath(path.replace('\\', '/')))
+
+def mark(conn):
+    # Iterating the cursor streams rows instead of loading them all
+    marked = set()
+    for (path,) in conn.execute("SELECT resume_path FROM students WHERE resume_path <> '' "
+                                "UNION SELECT photo_path FROM students WHERE photo_path <> ''"):
+        marked.add(normalize(path))
+    return marked
+
+def candidates(marked, directories=UPLOAD_DIRS, grace_period=GRACE_PERIOD):
+    # Unreferenced files older than the grace period, as (path, size) pairs
+    cutoff = time.time() - grace_period
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False) or normalize(entry.path) in marked:
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime < cutoff:
+                    yield entry.path, stat.st_size
+
+def sweep(files, dry_run=False, batch_size=SWEEP_BATCH, listing=None):
+    # Returns (files removed, bytes freed); a dry run only counts them.
+    # listing, if given, collects the paths removed (or that would be).
+    removed = freed = 0
+    for path, size in files:
+        if not dry_run:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            if (removed + 1) % batch_size == 0:
+                time.sleep(SWEEP_PAUSE)
+        removed += 1
+        freed += size
+        if listing is not None:
+            listing.append(path)
+    return removed, freed
+
+def collect(conn=None, dry_run=False, grace_period=GRACE_PERIOD, directories=None, listing=None):
+    # Sweeps the current shard's upload folders unless told otherwise
+    if directories is None:
+        directories = [upload_path(directory) for directory in UPLOAD_DIRS]
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        marked = mark(conn)
+    finally:
+        if own_conn:
+            conn.close()
+    removed, freed = sweep(candidates(marked, directories, grace_period), dry_run, listing=listing)
+    logger.info('upload gc: %d files, %d bytes %s (%d referenced)', removed, freed,
+                'reclaimable' if dry_run else 'removed', len(marked))
+    return removed, freed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dry-run', action='store_true', help='list what would be removed')
+    parser.add_argument('--grace-hours', type=float, default=GRACE_PERIOD / 3600,
+                        help='keep unreferenced files younger than this')
+    args = parser.parse_args()
+
+    for shard in SHARDS:
+        started = time.perf_counter()
+        listing = []
+        with use_shard(shard):
+            removed, freed = collect(dry_run=args.dry_run, grace_period=args.grace_hours * 3600, listing=listing)
+        if args.dry_run:
+            for path in listing:
+                print(path)
+        print(f"{shard.name}: {removed} files, {freed / 1024 ** 2:.1f} MiB {'reclaimable' if args.dry_run else 'removed'} "
+              f'in {time.perf_counter() - started:.1f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""A single writer thread that commits queued writes in groups.
+
+SQLite lets one connection write at a time and every commit waits for the
+disk. When many sessions write at once (registration day), each one opening
+its own transaction means they queue on the write lock and pay for a sync
+each. Here callers hand their write to a queue instead; one thread takes
+whatever has queued up within a short window, runs it all in one transaction
+and commits once. Each write runs in its own savepoint, so a constraint
+violation fails only that caller and the rest of the group still commits.
+Callers get their result (or exception) back once the group is committed.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from db import current_db_path, get_db_connection, log_query
+
+# How long the writer waits for more writes to join a group, and the most it
+# puts in one transaction
+GROUP_COMMIT_WINDOW = 0.002
+MAX_GROUP_SIZE = 500
+
+class WriteQueue:
+    def __init__(self, db_path, window=GROUP_COMMIT_WINDOW, max_group=MAX_GROUP_SIZE):
+        self.db_path = db_path
+        self.window = window
+        self.max_group = max_group
+        self.groups = 0
+        self.writes = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, work):
+        # work(conn) runs on the writer thread; returns a Future for its result
+        if not self.alive:
+            raise RuntimeError('the database writer stopped')
+        future = Future()
+        self._queue.put((work, future))
+        if not self.alive:
+            # Stopped while this was queued, after it last emptied the queue
+            self._fail_queued()
+        return future
+
+    def submit_sql(self, sql, params=()):
+        # One statement; the Future's result is the new row's id
+        def work(conn):
+            log_query(sql, params)
+            return conn.execute(sql, params).lastrowid
+        return self.submit(work)
+
+    def execute(self, sql, params=()):
+        return self.submit_sql(sql, params).result()
+
+    def _collect(self):
+        group = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(group) < self.max_group:
+            remaining = deadline - time.monotonic()
+            try:
+                group.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return group
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def _commit(self, conn, group):
+        # Runs one group in one transaction; returns (future, result, error)
+        # for each write once the group is committed
+        results = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for work, future in group:
+                conn.execute('SAVEPOINT write')
+                try:
+                    results.append((future, work(conn), None))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write')
+                    results.append((future, None, e))
+                conn.execute('RELEASE write')
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        return results
+
+    def _run(self):
+        conn, group = None, []
+        try:
+            while True:
+                group = self._collect()
+                try:
+                    if conn is None:
+                        conn = get_db_connection(self.db_path)
+                        conn.isolation_level = None
+                    results = self._commit(conn, group)
+                except Exception as e:
+                    # The group as a whole failed (say the database stayed
+                    # locked, or couldn't be opened); every caller in it gets
+                    # the error and the next group starts on a new connection
+                    for work, future in group:
+                        future.set_exception(e)
+                    conn = _close_quietly(conn)
+                    continue
+                # Results are handed out only once they are durable
+                for future, result, error in results:
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(result)
+                self.groups += 1
+                self.writes += len(group)
+                group = []
+        finally:
+            # Nothing will run what is left; submit() refuses new writes and
+            # get_write_queue() starts a new writer
+            _close_quietly(conn)
+            self._fail_queued(group)
+
+    def _fail_queued(self, group=()):
+        stopped = RuntimeError('the database writer stopped')
+        for work, future in group:
+            if not future.done():
+                future.set_exception(stopped)
+        while True:
+            try:
+                work, future = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            future.set_exception(stopped)
+
+def _close_quietly(conn):
+    # Returns None, for the caller to drop its reference
+    if conn is not None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    return None
+
+_write_queues = {}
+_write_queues_lock = threading.Lock()
+
+def get_write_queue(db_path=None):
+    # One writer per database and process, started on first use
+    db_path = db_path or current_db_path()
+    with _write_queues_lock:
+        if db_path not in _write_queues or not _write_queues[db_path].alive:
+            _write_queues[db_path] = WriteQueue(db_path)
+        return _write_queues[db_path]
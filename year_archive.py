@@ -0,0 +1,330 @@
+"""Move graduated academic years out of the live database into archive files.
+
+Every admin search scans the students table, and old cohorts never leave it.
+Archiving an academic year moves its students (and their login accounts)
+into a database of its own, archive/<db>-<year>.db next to the shard's
+database, and their resumes and photos into archive/<year>/ under the
+shard's upload root. Rows move in batches, each its own short transaction,
+so the app keeps running while a large year is archived.
+
+Archived years stay searchable: searches that ask for them open the archive
+files with ATTACH, only when asked, and read them through one view.
+
+    python year_archive.py 2015 2016
+    python year_archive.py --dry-run "2019 - 2021"
+"""
+import argparse
+import filecmp
+import glob
+import itertools
+import os
+import re
+import shutil
+import sqlite3
+import time
+
+import pandas as pd
+
+import db
+from facets import FACETS, count_groups, facet_clause
+from file_index import upload_changed
+from queries import Table
+from shards import SHARDS, current_shard, upload_path, use_shard
+from upload_gc import normalize
+
+ARCHIVE_DIR = 'archive'
+# Students moved per transaction, and the pause between batches so live
+# writers get the lock in between
+ARCHIVE_BATCH = 500
+ARCHIVE_PAUSE = 0.05
+# SQLite's default limit on attached databases
+ATTACH_LIMIT = 10
+UPLOAD_FOLDERS = {'resume_path': 'resumes', 'photo_path': 'photos'}
+
+# Rows are keyed by the archive's own archive_id. id and user_id are the
+# live ids at the time, which the live database may hand out again to
+# students archived into the same year later.
+ARCHIVE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS users
+       (archive_id INTEGER PRIMARY KEY, id INTEGER, username TEXT, password TEXT, is_admin INTEGER)''',
+    # The course is kept by name: the live courses table may rename or drop it
+    '''CREATE TABLE IF NOT EXISTS students
+       (archive_id INTEGER PRIMARY KEY, id INTEGER, user_id INTEGER, name TEXT, email TEXT, course TEXT,
+       student_id TEXT, register_no TEXT, academic_year TEXT,
+       resume_path TEXT, resume_sha256 TEXT, photo_path TEXT, archived_at TEXT)''',
+    'CREATE INDEX IF NOT EXISTS idx_students_id ON students (id)',
+    'CREATE INDEX IF NOT EXISTS idx_users_id ON users (id)',
+]
+
+ARCHIVED_USER_COLUMNS = ['id', 'username', 'password', 'is_admin']
+
+ARCHIVED_COLUMNS = ['id', 'user_id', 'name', 'email', 'course', 'student_id', 'register_no', 'academic_year',
+                    'resume_path', 'resume_sha256', 'photo_path']
+# A live row matching an archived one on these is that student, archived by
+# a run that stopped before removing the live row
+IDENTITY_COLUMNS = ARCHIVED_COLUMNS[:8]
+
+# Searches read every attached archive through this temporary view
+ARCHIVED_STUDENTS = Table('archived_students', {
+    field: f'archived_students.{field}' for field in ARCHIVED_COLUMNS
+})
+
+# The facet sidebar's filters, on the archive's columns
+ARCHIVED_FACETS = {
+    'course': 'archived_students.course',
+    'academic_year': 'archived_students.academic_year',
+    'has_resume': "CASE WHEN COALESCE(archived_students.resume_path, '') <> '' THEN 1 ELSE 0 END",
+    'has_photo': "CASE WHEN COALESCE(archived_students.photo_path, '') <> '' THEN 1 ELSE 0 END",
+}
+
+def year_slug(year):
+    return re.sub(r'[^0-9A-Za-z]+', '-', year).strip('-') or 'unknown'
+
+def _archive_prefix(db_path=None):
+    # archive/<db name> next to the database; each year adds -<year>.db
+    db_path = os.path.abspath(db_path or db.current_db_path())
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    return os.path.join(os.path.dirname(db_path), ARCHIVE_DIR, stem)
+
+def archive_path(year, db_path=None):
+    return f'{_archive_prefix(db_path)}-{year_slug(year)}.db'
+
+def archive_files(db_path=None):
+    # This database's archives, oldest year first
+    return sorted(glob.glob(glob.escape(_archive_prefix(db_path)) + '-*.db'))
+
+def _add_archive_ids(conn):
+    # Archives written before archive_id was added were keyed on the live id
+    for table in ('users', 'students'):
+        columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+        if columns and 'archive_id' not in columns:
+            conn.execute(f'ALTER TABLE {table} RENAME TO old_{table}')
+    for statement in ARCHIVE_SCHEMA:
+        conn.execute(statement)
+    for table, columns in (('users', ARCHIVED_USER_COLUMNS), ('students', ARCHIVED_COLUMNS + ['archived_at'])):
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (f'old_{table}',)).fetchone():
+            conn.execute(f"INSERT INTO {table} ({', '.join(columns)}) "
+                         f"SELECT {', '.join(columns)} FROM old_{table} ORDER BY id")
+            conn.execute(f'DROP TABLE old_{table}')
+
+def init_archive(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            _add_archive_ids(conn)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.close()
+
+def archive_names(destination, student_id, name):
+    # <id>-<name>, then <id>-1-<name>, <id>-2-<name>, ... for files of
+    # students archived earlier under the same (since reused) id
+    yield os.path.join(destination, f'{student_id}-{name}')
+    for number in itertools.count(1):
+        yield os.path.join(destination, f'{student_id}-{number}-{name}')
+
+def move_upload(path, student_id, destination, shared, taken):
+    # Moves one upload into the archive folder and returns its new path.
+    # Files another live student still points at are copied instead. An
+    # archived file is never overwritten: the upload takes the first free
+    # name, or that of an identical file. taken holds the files archived
+    # rows refer to; any other file under the student's names was moved by
+    # an interrupted run and is picked up where it landed.
+    if not path:
+        return path
+    source = path.replace('\\', '/')
+    name = os.path.basename(source)
+    if os.path.exists(source):
+        os.makedirs(destination, exist_ok=True)
+        for target in archive_names(destination, student_id, name):
+            if not os.path.exists(target) or filecmp.cmp(source, target, shallow=False):
+                break
+        if normalize(source) in shared:
+            if not os.path.exists(target):
+                shutil.copy2(source, target)
+        else:
+            if os.path.exists(target):
+                os.remove(source)
+            else:
+                shutil.move(source, target)
+            upload_changed(source)
+        return target
+    for target in archive_names(destination, student_id, name):
+        if not os.path.exists(target):
+            return path
+        if normalize(target) not in taken:
+            return target
+
+def archive_year(year, batch_size=ARCHIVE_BATCH, pause=ARCHIVE_PAUSE, dry_run=False):
+    # Moves the current shard's students for one academic year into its
+    # archive. Returns the number of students moved (or that would be).
+    if db.is_postgres():
+        raise RuntimeError('Archiving years relies on SQLite ATTACH')
+    conn = db.get_db_connection()
+    conn.isolation_level = None
+    try:
+        if dry_run:
+            return conn.execute('SELECT COUNT(*) FROM students WHERE academic_year = ? AND deleted_at IS NULL',
+                                (year,)).fetchone()[0]
+
+        path = archive_path(year)
+        init_archive(path)
+        conn.execute('ATTACH DATABASE ? AS archive', (path,))
+        destination = upload_path(os.path.join(ARCHIVE_DIR, year_slug(year)))
+        # Uploads other students still refer to, which must stay in place;
+        # deleted students stay behind for the purge and may be restored
+        shared = {normalize(row[0]) for row in conn.execute(
+            "SELECT resume_path FROM students WHERE resume_path <> '' AND "
+            "(academic_year IS NOT ? OR deleted_at IS NOT NULL) "
+            "UNION SELECT photo_path FROM students WHERE photo_path <> '' AND "
+            "(academic_year IS NOT ? OR deleted_at IS NOT NULL)", (year, year))}
+
+        moved = 0
+        while True:
+            rows = conn.execute('''SELECT students.id, students.user_id, students.name, students.email,
+                                   courses.name AS course, students.student_id, students.register_no,
+                                   students.academic_year, students.resume_path, students.resume_sha256,
+                                   students.photo_path
+                                   FROM students LEFT JOIN courses ON courses.id = students.course_id
+                                   WHERE students.academic_year = ? AND students.deleted_at IS NULL
+                                   ORDER BY students.id LIMIT ?''',
+                                (year, batch_size)).fetchall()
+            if not rows:
+                break
+            ids = [row['id'] for row in rows]
+            user_ids = [row['user_id'] for row in rows if row['user_id'] is not None]
+            id_list = ', '.join('?' * len(ids))
+            user_list = ', '.join('?' * len(user_ids))
+            # In WAL mode a crash can commit the archive but not the live
+            # database; those students are already archived and only their
+            # live rows are left to remove
+            archived = conn.execute(f'''SELECT {', '.join(ARCHIVED_COLUMNS)} FROM archive.students
+                                        WHERE id IN ({id_list})''', ids).fetchall()
+            identities = {tuple(row[:len(IDENTITY_COLUMNS)]) for row in archived}
+            taken = {normalize(row[field]) for row in archived for field in UPLOAD_FOLDERS if row[field]}
+            # Files move first: if the run stops before the rows follow,
+            # the next run finds them in the archive folder, whereas rows
+            # moved without their files would leave the files to upload_gc
+            records = []
+            for row in rows:
+                record = dict(row)
+                if tuple(record[column] for column in IDENTITY_COLUMNS) in identities:
+                    continue
+                for field, folder in UPLOAD_FOLDERS.items():
+                    record[field] = move_upload(record[field], record['id'], os.path.join(destination, folder),
+                                                shared, taken)
+                records.append([record[column] for column in ARCHIVED_COLUMNS])
+
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany(f'''INSERT INTO archive.students ({', '.join(ARCHIVED_COLUMNS)}, archived_at)
+                                     VALUES ({', '.join('?' * len(ARCHIVED_COLUMNS))}, datetime('now'))''', records)
+                conn.execute(f'DELETE FROM main.students WHERE id IN ({id_list})', ids)
+                if user_ids:
+                    # Admin accounts are never archived with a student row
+                    user_filter = f'id IN ({user_list}) AND COALESCE(is_admin, 0) = 0'
+                    same_user = ' AND '.join(f'archive.users.{column} IS main.users.{column}'
+                                             for column in ARCHIVED_USER_COLUMNS)
+                    conn.execute(f'''INSERT INTO archive.users ({', '.join(ARCHIVED_USER_COLUMNS)})
+                                     SELECT {', '.join(ARCHIVED_USER_COLUMNS)} FROM main.users WHERE {user_filter}
+                                     AND NOT EXISTS (SELECT 1 FROM archive.users WHERE {same_user})''', user_ids)
+                    conn.execute(f'DELETE FROM main.users WHERE {user_filter}', user_ids)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            moved += len(rows)
+            time.sleep(pause)
+        return moved
+    finally:
+        conn.close()
+
+def archived_search_clause(search_query='', course_filter=None, filters=None):
+    # data.student_search_clause, on the archived_students view
+    where, params = '1', []
+    if search_query:
+        where = ("(fold_case(archived_students.name) LIKE ? ESCAPE '\\' "
+                 "OR fold_case(archived_students.email) LIKE ? ESCAPE '\\')")
+        params += [db.contains_pattern(search_query)] * 2
+    if course_filter:
+        where += ' AND archived_students.course = ?'
+        params.append(course_filter)
+    facet_where, facet_params = facet_clause(filters, ARCHIVED_FACETS)
+    if facet_where:
+        where += f' AND {facet_where}'
+        params.extend(facet_params)
+    return where, params
+
+def query_archives(read, db_path=None):
+    # Calls read(conn) with the shard's archives readable through the
+    # archived_students view; returns its results, one per connection. The
+    # archives are attached only for this, at most ATTACH_LIMIT to a
+    # connection.
+    paths = archive_files(db_path or current_shard().db_path)
+    results = []
+    for start in range(0, len(paths), ATTACH_LIMIT):
+        conn = sqlite3.connect(':memory:', uri=True)
+        conn.create_function('fold_case', 1, db.fold_case, deterministic=True)
+        try:
+            selects = []
+            for number, path in enumerate(paths[start:start + ATTACH_LIMIT]):
+                # Read-only, so a search never creates or locks an archive
+                conn.execute(f'ATTACH DATABASE ? AS archive{number}', (f'file:{path}?mode=ro',))
+                selects.append(f"SELECT {', '.join(ARCHIVED_COLUMNS)} FROM archive{number}.students")
+            conn.execute(f"CREATE TEMP VIEW archived_students AS {' UNION ALL '.join(selects)}")
+            results.append(read(conn))
+        finally:
+            conn.close()
+    return results
+
+def search_archived_frame(search_query='', course_filter=None, fields=None, db_path=None, filters=None):
+    # Students in the current shard's archives matching the same search as
+    # data.search_students_frame
+    fields = fields or ['name', 'email', 'course', 'student_id', 'register_no', 'academic_year', 'resume_path']
+    where, params = archived_search_clause(search_query, course_filter, filters)
+    sql = ARCHIVED_STUDENTS.select(fields, where=where)
+    frames = query_archives(lambda conn: db.frame_from_cursor(
+        conn.execute(sql, params), categories=('course', 'academic_year'),
+        strings=('name', 'email', 'student_id', 'register_no')), db_path)
+    if not frames:
+        return pd.DataFrame(columns=fields)
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+def archived_facet_counts(search_query='', filters=None, db_path=None):
+    # data.get_student_facets for the current shard's archives, so the
+    # sidebar counts the archived students the list shows
+    where, params = archived_search_clause(search_query)
+    selects = ', '.join(f'{ARCHIVED_FACETS[facet]} AS {facet}' for facet in FACETS)
+    sql = (f'SELECT {selects}, COUNT(*) AS students FROM archived_students WHERE {where} '
+           f"GROUP BY {', '.join(str(position) for position in range(1, len(FACETS) + 1))}")
+    groups = [dict(zip([*FACETS, 'students'], row))
+              for rows in query_archives(lambda conn: conn.execute(sql, params).fetchall(), db_path)
+              for row in rows]
+    return count_groups(groups, filters)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('years', nargs='+', help='academic years to archive, as stored on students')
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH, help='students moved per transaction')
+    parser.add_argument('--dry-run', action='store_true', help='count the students that would move')
+    args = parser.parse_args()
+
+    for shard in SHARDS:
+        if db.is_postgres(shard.db_path):
+            print(f'{shard.name}: skipped, archiving needs SQLite')
+            continue
+        for year in args.years:
+            started = time.perf_counter()
+            with use_shard(shard):
+                moved = archive_year(year, batch_size=args.batch_size, dry_run=args.dry_run)
+            print(f"{shard.name} {year}: {moved} students {'to archive' if args.dry_run else 'archived'} "
+                  f'in {time.perf_counter() - started:.1f}s')
+
+if __name__ == '__main__':
+    main()